@@ -4,37 +4,51 @@ Date: 10/18/2025
 Purpose: TCP Socket Programming Project (Client Side)
 
 This script acts as a client for uploading and downloading files
-to/from a server using basic file transfer commands (`put`, `get`, and `quit`).
+to/from a server using basic file transfer commands (`put`, `get`, and `quit`),
+and for looking up what is stored there (`list` and `stat`).
 
 All communication is done over TCP sockets.
 
 Usage:
-    python clientTCP.py <port> <IP Address>
+    python clientTCP.py <port> <IP Address> [tls[=<CA file>]]
         (python clientTCP.py 12345 127.0.0.1
+        (python clientTCP.py 12345 127.0.0.1 tls=server.pem    # TLS, trusting server.pem
         
 Commands:
     - put <filename> : Uploads a file to the server.
     - get <filename> : Downloads a file from the server.
+    - list [prefix]  : Lists your stored files (starting with prefix).
+    - stat <filename>: Shows a stored file's size, time and SHA-256.
     - quit           : Exits the client program.
 
 The server stores uploaded files in directories based on the client's IP address.
+The transfers themselves are done by common/client.py; see tools/transfer.py
+for a non-interactive version of this client.
 
 References:
     https://realpython.com/python-sockets/
 """
 
-import socket
+import os
 import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.client import TCPClient, TransferError
+from common.secure import client_tls_context
 
 # ========================== Helper Functions ==========================
 
-def commandLoop():
+def commandLoop(client):
     """
     Loop to continually prompt the user for commands until 'quit' is entered.
-    Handles 'put', 'get', and 'quit' commands.
+    Handles 'put', 'get', 'list', 'stat' and 'quit' commands.
+
+    Args:
+        client (TCPClient): Connection settings for the server.
     """
     while True:
-        commandLine = input("Enter command (put <file>, get <file>, quit): ").strip()
+        commandLine = input("Enter command (put <file>, get <file>, list [prefix], stat <file>, quit): ").strip()
 
         if not commandLine:
             continue
@@ -51,124 +65,103 @@ def commandLoop():
             runQuit()
             break  # Exit the loop after quitting
 
+        if command == "LIST" and len(parts) <= 2:
+            runList(client, parts[1] if len(parts) == 2 else "")
+            continue
+
         if len(parts) != 2:
-            print("Incorrect input. Usage:\nput <filename>\nget <filename>\nquit")
+            print("Incorrect input. Usage:\nput <filename>\nget <filename>\n"
+                  "list [prefix]\nstat <filename>\nquit")
             continue
 
         fileName = parts[1]
 
         if command == "PUT":
-            runPut(fileName)
+            runPut(client, fileName)
 
         elif command == "GET":
-            runGet(fileName)
+            runGet(client, fileName)
+
+        elif command == "STAT":
+            runStat(client, fileName)
 
         else:
             print("Unknown command. Try again.")
 
 
-def fileToBytes(fileName, sock):
-    """
-    Reads a file in binary mode and sends it over the socket in chunks.
-
-    Args:
-        fileName (str): The name of the file to send.
-        sock (socket): The socket to send the file through.
-    """
-    try:
-        with open(fileName, 'rb') as f:
-            fileBytes = f.read(1024)
-            while fileBytes:
-                sock.send(fileBytes)
-                fileBytes = f.read(1024)
-        sock.send(b"<EOF>")  # Mark end of file for the server
-
-    except FileNotFoundError:
-        print(f"[-] Error: The file '{fileName}' was not found.")
-    except IOError as ioe:
-        print(f"[-] Error reading file '{fileName}': {ioe}")
-
-
-def runPut(fileName):
+def runPut(client, fileName):
     """
     Handles the file upload ("put") command.
     Sends the file to the server and waits for acknowledgment.
 
     Args:
+        client (TCPClient): Connection settings for the server.
         fileName (str): The file to upload.
     """
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipAddress, int(serverPort)))
-        print("[+] Connected to Server")
-
-        command = f"put {fileName}"
-        sock.send(command.encode())
-
-        acknowledgment = sock.recv(1024).decode()
-        if acknowledgment != "Ack 0":
-            print("[-] Server error or unexpected acknowledgment.")
-            sock.close()
-            return
-        else:
-            print("[+] Server ready. Sending file...")
-
-        fileToBytes(fileName, sock)
-
-        acknowledgment = sock.recv(1024).decode()
-        if acknowledgment != "Ack 1":
-            print("[-] Server failed to confirm upload.")
-        else:
-            print("[+] File successfully uploaded.")
-
-    except Exception as e:
-        print(f"[-] Error in runPut: {e}")
+    if not os.path.exists(fileName):
+        print(f"[-] Error: The file '{fileName}' was not found.")
+        return
 
-    finally:
-        sock.close()
+    result = client.put(fileName)
+    if result.ok:
+        print(f"[+] {result.message}")
+    else:
+        print(f"[-] Error in runPut: {result.message}")
 
 
-def runGet(fileName):
+def runGet(client, fileName):
     """
     Handles the file download ("get") command.
     Receives the file from the server and saves it locally.
 
     Args:
+        client (TCPClient): Connection settings for the server.
         fileName (str): The file to download.
     """
+    result = client.get(fileName)
+    if result.ok:
+        print("[+] File delivered from server.")
+    else:
+        print(f"[-] Error in runGet: {result.message}")
+
+
+def runList(client, prefix):
+    """
+    Handles the "list" command. Prints every stored file whose name starts
+    with prefix, fetching them from the server a page at a time.
+
+    Args:
+        client (TCPClient): Connection settings for the server.
+        prefix (str): Only names starting with this are listed.
+    """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipAddress, int(serverPort)))
-        print("[+] Connected to Server")
-
-        command = f"get {fileName}"
-        sock.send(command.encode())
-
-        acknowledgment = sock.recv(1024).decode()
-        if acknowledgment == "File not found":
-            print("[-] Server could not find the requested file.")
-            return
-        elif acknowledgment != "Ack 0":
-            print("[-] Unexpected server response.")
-            return
-
-        print("[+] Server acknowledged. Receiving file...")
-
-        with open(f"downloaded_{fileName}", 'wb') as f:
-            while True:
-                data = sock.recv(1024)
-                if b"<EOF>" in data:
-                    f.write(data.replace(b"<EOF>", b""))
-                    break
-                f.write(data)
+        count = 0
+        for info in client.list_all(prefix):
+            print(f"    {info.name}  {info.size} bytes")
+            count += 1
+        print(f"[+] {count} file(s) stored.")
+    except (OSError, TransferError) as e:
+        print(f"[-] Error in runList: {e}")
 
-        print("[+] File delivered from server.")
 
-    except Exception as e:
-        print(f"[-] Error in runGet: {e}")
+def runStat(client, fileName):
+    """
+    Handles the "stat" command. Prints a stored file's size, time and hash.
 
-    finally:
-        sock.close()
+    Args:
+        client (TCPClient): Connection settings for the server.
+        fileName (str): The stored file to look up.
+    """
+    try:
+        info = client.stat(fileName)
+    except (OSError, TransferError) as e:
+        print(f"[-] Error in runStat: {e}")
+        return
+    if info is None:
+        print(f"[-] Server has no file '{fileName}'.")
+        return
+    print(f"[+] {info.name}: {info.size} bytes, modified {time.ctime(info.mtime)}, "
+          f"sha256 {info.digest or 'unknown'}")
 
 
 def runQuit():
@@ -184,18 +177,21 @@ def main():
     """
     Parses command line arguments and starts the client command loop.
     Expected usage:
-        python clientTCP.py <ServerPort> <ServerIP>
+        python clientTCP.py <ServerPort> <ServerIP> [tls[=<CA file>]]
     """
-    global serverPort, ipAddress
-
-    if len(sys.argv) != 3:
-        print("Incorrect input. Usage: python clientTCP.py <ServerPort> <ServerIP>")
+    if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and not sys.argv[3].startswith("tls")):
+        print("Incorrect input. Usage: python clientTCP.py <ServerPort> <ServerIP> [tls[=<CA file>]]")
         sys.exit(1)
 
     serverPort = sys.argv[1]
     ipAddress = sys.argv[2]
 
-    commandLoop()
+    sslContext = None
+    if len(sys.argv) == 4:
+        caFile = sys.argv[3].partition("=")[2] or None
+        sslContext = client_tls_context(caFile)
+
+    commandLoop(TCPClient(ipAddress, serverPort, ssl_context=sslContext))
 
 
 if __name__ == "__main__":
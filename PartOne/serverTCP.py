@@ -6,98 +6,212 @@ This script implements the server side of a TCP-based file transfer application.
 It supports file upload and download operations initiated by the client.
 
 Usage:
-    python serverTCP.py <port>
+    python serverTCP.py <port> [--storage cas|dir] [--storage-root <dir>]
+                        [--global-rate B/s] [--client-rate B/s] [--session-rate B/s]
+                        [--limits-file <json>] [--tls-cert <pem> --tls-key <pem>]
+                        [--max-sessions N] [--max-client-sessions N]
+                        [--max-client-buffer BYTES] [--idle-timeout S]
+                        [--read-timeout S] [--keepalive-idle S] [--backlog N]
+                        [--timings] [--profile-dir <dir>]
         (IE: python serverTCP.py 12345)
 
 Expected client commands:
-    put <filename>     # Upload a file to the server
+    put <filename> <size>
+                       # Upload a file: <size> bytes follow the "Ack 0"
     get <filename>     # Download a file from the server
+    stat <filename>    # Size, mtime and SHA-256 of a stored file
+    list [<prefix>] [limit=<n>] [after=<cursor>]
+                       # One page of the client's files, in name order
 
-Files will be stored per client IP under the 'uploads/' directory.
+Files are stored per client IP through the shared storage layer
+(common/storage.py). By default identical files are stored once in a
+content-addressed blob store under 'uploads/'. `stat` and `list` are answered
+from the storage layer's in-memory index (common/index.py); the reply is sent
+and the connection closed.
+
+Each client connection is handled in its own thread. Transfers are paced by
+the shared bandwidth scheduler (common/scheduler.py): per-client and
+per-session token buckets, fair queuing between transfers and a global cap.
+Limits in --limits-file are re-read whenever the file changes.
+
+With --tls-cert/--tls-key every connection is wrapped in TLS (common/secure.py).
+The server issues session tickets, so clients that reconnect for each command
+resume their session instead of repeating the full handshake.
+
+Resource limits (common/limits.py): connections over the session caps are
+refused with "Server busy". A client gets --idle-timeout seconds to send its
+command (and finish the TLS handshake), and a transfer that makes no progress
+for --read-timeout seconds is dropped, discarding any partial upload. TCP
+keepalive detects peers that vanished without closing the connection.
+
+--timings prints each transfer's phase breakdown (handshake, data, commit,
+finish) and how the data phase divided between network, disk and pacing,
+plus the totals across transfers on Ctrl-C. --profile-dir also runs
+transfers under cProfile and writes one report per transfer
+(common/timing.py).
 
 References:
     https://realpython.com/python-sockets/
 """
 
+import argparse
+import errno
+import os
 import socket
 import sys
-import os
+import threading
+import time
 
-def handle_client(client_socket, client_address):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import index, limits, timing
+from common.scheduler import BandwidthScheduler, watch_limits_file
+from common.secure import server_tls_context
+from common.storage import BACKENDS, open_storage
+
+# Size of the reads and writes on the data path. Large buffers keep per-call
+# overhead (and, with TLS, per-record overhead) low.
+BUFFER_SIZE = 64 * 1024
+
+# accept() errors that leave the listening socket usable. Out of descriptors
+# (EMFILE/ENFILE) or kernel memory, the server pauses for ACCEPT_BACKOFF
+# seconds so that finishing sessions can free some before it tries again.
+ACCEPT_RETRY_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM,
+                       errno.ECONNABORTED, errno.EPROTO, errno.EPERM}
+ACCEPT_BACKOFF = 0.1
+
+def handle_client(client_socket, client_address, store, scheduler, lease, tls_context=None,
+                  idle_timeout=None, read_timeout=None, instruments=None):
     """
     Handles a single client connection.
     
     Parameters:
         client_socket (socket): The socket connected to the client.
         client_address (tuple): The client's address (IP, port).
+        store (StorageBackend): Where uploaded files are kept.
+        scheduler (BandwidthScheduler): Paces the transfer's chunks.
+        lease (limits.Lease): The connection's admission; released on close.
+        tls_context (SSLContext): If given, the connection is wrapped in TLS.
+        idle_timeout (float): Seconds allowed for the handshake and command.
+        read_timeout (float): Seconds a transfer may go without progress.
+        instruments (timing.Instrumentation): Times and profiles the transfer.
         
-    Supports two commands:
-        - "put <filename>": receives a file and saves it.
+    Supports four commands:
+        - "put <filename> <size>": receives exactly <size> bytes and saves them.
         - "get <filename>": sends a file back to the client.
+        - "stat <filename>": sends the file's size, mtime and digest.
+        - "list [<prefix>] [limit=<n>] [after=<cursor>]": sends a page of
+          the client's files.
     """
     print(f"[+] Connection from {client_address}")
+    transfer = scheduler.session(client_address[0])
+    instruments = instruments or timing.Instrumentation()
+    timer = instruments.start(f"{client_address[0]}:{client_address[1]}")
 
     try:
+        timer.phase("handshake")
+        client_socket.settimeout(idle_timeout)
+        if tls_context is not None:
+            client_socket = tls_context.wrap_socket(client_socket, server_side=True)
+
         # Receive the initial command from the client
         command = client_socket.recv(1024).decode().strip()
         print(f"[+] Command received: {command}")
+        client_socket.settimeout(read_timeout)
 
-        # Split the command into action and filename
+        # Split the command into action and filename (list takes options
+        # instead, put also takes the file's size)
         parts = command.split()
-        if len(parts) != 2:
+        if not parts or (parts[0] != "list" and len(parts) != (3 if parts[0] == "put" else 2)):
             print("[-] Invalid command format.")
             client_socket.close()
             return
 
-        action, filename = parts[0], parts[1]
-        client_ip = client_address[0]
+        action, filename = parts[0], (parts[1] if len(parts) > 1 else "")
+        if timer.enabled:
+            # The command is only known now; NULL_TIMER is shared, so never relabel it
+            timer.label = f"{action} {filename} {timer.label}"
 
         # Organize files by client IP address
-        save_dir = os.path.join("uploads", client_ip.replace('.', '_'))
-        os.makedirs(save_dir, exist_ok=True)
+        client_ip = client_address[0]
 
-        if action == "put":
+        if action == "list":
+            # === LIST COMMAND ===
+            timer.phase("query")
+            try:
+                prefix, after, limit = index.parse_list_options(parts[1:])
+            except ValueError as e:
+                client_socket.sendall(f"Error: {e}".encode())
+                return
+            client_socket.sendall(index.format_listing(store.list(client_ip, prefix, after, limit)))
+
+        elif action == "stat":
+            # === STAT COMMAND ===
+            timer.phase("query")
+            info = store.stat(client_ip, filename)
+            client_socket.sendall(index.format_stat(info) if info else b"File not found")
+
+        elif action == "put":
             # === PUT COMMAND ===
-            filepath = os.path.join(save_dir, filename)
+            filesize = int(parts[2]) if parts[2].isdecimal() else None
+            if filesize is None:
+                client_socket.sendall(f"Error: invalid size '{parts[2]}'".encode())
+                print("[-] Invalid upload size.")
+                return
 
             # Acknowledge receipt of command
-            client_socket.send("Ack 0".encode())
+            client_socket.sendall("Ack 0".encode())
 
-            # Receive the file content
-            with open(filepath, 'wb') as f:
-                while True:
-                    data = client_socket.recv(1024)
-                    if b"<EOF>" in data:
-                        f.write(data.replace(b"<EOF>", b""))
-                        break
+            # Receive exactly `filesize` bytes (discarded if the transfer fails)
+            timer.phase("data")
+            with store.writer(client_ip, filename) as f:
+                received = 0
+                while received < filesize:
+                    data = client_socket.recv(min(BUFFER_SIZE, filesize - received))
+                    timer.lap("recv")
+                    if not data:
+                        raise ConnectionError(
+                            f"client closed connection after {received} of {filesize} bytes")
+                    transfer.acquire(len(data))
+                    timer.lap("pacing")
                     f.write(data)
+                    timer.lap("disk_write")
+                    received += len(data)
+                if f.size != filesize:
+                    raise ValueError(f"wrote {f.size} of {filesize} bytes")
+                timer.phase("commit")
 
-            print(f"[+] File saved to {filepath}")
-            client_socket.send("Ack 1".encode())
+            timer.phase("finish")
+            print(f"[+] File {filename} stored for {client_ip} ({received} bytes)")
+            client_socket.sendall(f"Ack 1 {received}".encode())
 
         elif action == "get":
             # === GET COMMAND ===
-            filepath = os.path.join(save_dir, filename)
-
-            # Check if file exists before sending
-            if not os.path.exists(filepath):
-                client_socket.send("File not found".encode())
+            # Look the file up in the client's namespace
+            f = store.open(client_ip, filename)
+            if f is None:
+                client_socket.sendall("File not found".encode())
                 print("[-] Requested file not found.")
                 return
 
             # Acknowledge receipt of command
-            client_socket.send("Ack 0".encode())
+            client_socket.sendall("Ack 0".encode())
 
             # Send the file content
-            with open(filepath, 'rb') as f:
+            timer.phase("data")
+            with f:
                 while True:
-                    data = f.read(1024)
+                    data = f.read(BUFFER_SIZE)
+                    timer.lap("disk_read")
                     if not data:
                         break
-                    client_socket.send(data)
+                    transfer.acquire(len(data))
+                    timer.lap("pacing")
+                    client_socket.sendall(data)
+                    timer.lap("send")
 
             # Send end-of-file marker
-            client_socket.send(b"<EOF>")
+            timer.phase("finish")
+            client_socket.sendall(b"<EOF>")
             print(f"[+] Sent file {filename} to client.")
 
         else:
@@ -108,6 +222,9 @@ def handle_client(client_socket, client_address):
 
     finally:
         # Close the connection with the client
+        instruments.finish(timer)
+        transfer.close()
+        lease.close()
         client_socket.close()
         print(f"[+] Connection with {client_address} closed.\n")
 
@@ -118,26 +235,101 @@ def main():
 
     Listens on the port provided via command line argument,
     accepts incoming client connections, and delegates handling
-    to the `handle_client` function.
+    to the `handle_client` function in a new thread per client.
     """
-    if len(sys.argv) != 2:
-        print("Usage: python serverTCP.py <port>")
-        sys.exit(1)
+    limits.raise_fd_limit()
+    parser = argparse.ArgumentParser(description="TCP file server")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--storage", choices=sorted(BACKENDS), default="cas",
+                        help="storage backend (default: cas)")
+    parser.add_argument("--storage-root", default="uploads",
+                        help="directory holding stored files (default: uploads)")
+    parser.add_argument("--global-rate", type=int, help="total egress cap in bytes/s")
+    parser.add_argument("--client-rate", type=int, help="per-client-IP cap in bytes/s")
+    parser.add_argument("--session-rate", type=int, help="per-transfer cap in bytes/s")
+    parser.add_argument("--limits-file", help="JSON file with limits, reloaded on change")
+    parser.add_argument("--tls-cert", help="PEM certificate chain; enables TLS")
+    parser.add_argument("--tls-key", help="PEM private key for --tls-cert")
+    parser.add_argument("--max-sessions", type=int, default=limits.default_max_sessions(),
+                        help="connections served at once (default %(default)s, "
+                             "from the descriptor limit)")
+    parser.add_argument("--max-client-sessions", type=int,
+                        default=limits.DEFAULT_MAX_CLIENT_SESSIONS,
+                        help="connections served at once per client IP (default %(default)s)")
+    parser.add_argument("--max-client-buffer", type=int, default=limits.DEFAULT_MAX_CLIENT_BYTES,
+                        help="buffer bytes per client IP (default %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=30.0,
+                        help="seconds to wait for a command (default %(default)s)")
+    parser.add_argument("--read-timeout", type=float, default=60.0,
+                        help="seconds a transfer may stall (default %(default)s)")
+    parser.add_argument("--keepalive-idle", type=float, default=60.0,
+                        help="seconds of silence before keepalive probes (default %(default)s)")
+    parser.add_argument("--backlog", type=int, default=128,
+                        help="connections waiting to be accepted (default %(default)s)")
+    parser.add_argument("--timings", action="store_true",
+                        help="print a phase and step breakdown of every transfer")
+    parser.add_argument("--profile-dir",
+                        help="run transfers under cProfile, writing one report per transfer here")
+    args = parser.parse_args()
+    if bool(args.tls_cert) != bool(args.tls_key):
+        parser.error("--tls-cert and --tls-key must be given together")
+
+    tls_context = server_tls_context(args.tls_cert, args.tls_key) if args.tls_cert else None
 
-    server_port = int(sys.argv[1])
+    store = open_storage(args.storage, args.storage_root)
+    removed = store.remove_partial_uploads()
+    if removed:
+        print(f"[*] Removed {removed} abandoned partial uploads")
+    governor = limits.ResourceGovernor(args.max_sessions, args.max_client_sessions,
+                                       args.max_client_buffer)
+    scheduler = BandwidthScheduler(args.global_rate, args.client_rate, args.session_rate)
+    if args.limits_file:
+        watch_limits_file(scheduler, args.limits_file)
+    instruments = timing.Instrumentation(args.timings, args.profile_dir)
+    server_port = args.port
     server_ip = '0.0.0.0'  # Listen on all available interfaces
 
     # Create a TCP socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.bind((server_ip, server_port))
-    server_socket.listen(5)
+    server_socket.listen(args.backlog)
 
-    print(f"[+] Server listening on port {server_port}...")
+    print(f"[+] Server listening on port {server_port}{' (TLS)' if tls_context else ''}...")
+
+    try:
+        while True:
+            # Accept new client connection and serve it in its own thread
+            try:
+                client_sock, client_addr = server_socket.accept()
+            except OSError as e:
+                if e.errno not in ACCEPT_RETRY_ERRNOS:
+                    raise
+                print(f"[-] accept() failed: {e}")
+                if e.errno != errno.ECONNABORTED:
+                    time.sleep(ACCEPT_BACKOFF)
+                continue
+            try:
+                lease = governor.admit(client_addr[0], BUFFER_SIZE)
+            except limits.LimitExceeded as e:
+                print(f"[-] Refused {client_addr}: {e}")
+                if tls_context is None:
+                    try:
+                        client_sock.send(limits.BUSY_MESSAGE)
+                    except OSError:
+                        pass
+                client_sock.close()
+                continue
 
-    while True:
-        # Accept new client connection
-        client_sock, client_addr = server_socket.accept()
-        handle_client(client_sock, client_addr)
+            limits.enable_keepalive(client_sock, args.keepalive_idle)
+            # Replies and the get <EOF> marker are small writes; send them without delay
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=handle_client,
+                             args=(client_sock, client_addr, store, scheduler, lease, tls_context,
+                                   args.idle_timeout, args.read_timeout, instruments),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        if instruments.enabled:
+            print(instruments.report())
 
 
 if __name__ == "__main__":
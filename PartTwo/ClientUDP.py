@@ -4,19 +4,24 @@ Date: 10/20/2025
 Purpose: UDP Socket Programming Project (Client Side)
 
 This script acts as a client for uploading and downloading files
-to/from a server using basic file transfer commands (`put`, `get`, and `quit`).
+to/from a server using basic file transfer commands (`put`, `get`, and `quit`),
+and for looking up what is stored there (`list` and `stat`).
 
 All communication is done over UDP sockets using a stop-and-wait protocol
 to ensure reliable transfer of file data.
 
 Usage:
-    python clientUDP.py <port> <IP Address>
+    python clientUDP.py <port> <IP Address> [fec[:<k>[:<r>]]] [psk=<key file>]
     Example:
         python clientUDP.py 12345 127.0.0.1
+        python clientUDP.py 12345 127.0.0.1 fec:32         # FEC mode, adaptive parity
+        python clientUDP.py 12345 127.0.0.1 psk=udp.key    # Encrypted datagrams
 
 Commands:
     - put <filename> : Uploads a file to the server.
     - get <filename> : Downloads a file from the server.
+    - list [prefix]  : Lists your stored files (starting with prefix).
+    - stat <filename>: Shows a stored file's size, time and SHA-256.
     - quit           : Exits the client program.
 
 Notes:
@@ -24,123 +29,68 @@ Notes:
     - File transfers are done in chunks (default 1000 bytes).
     - Each chunk requires an ACK for reliable delivery.
     - A final FIN/ACK1 exchange signals end of file transfer.
+    - The protocol itself lives in common/client.py; see tools/transfer.py
+      for a non-interactive version of this client.
 
 References:
     https://realpython.com/python-sockets/
 """
 
-import socket
-import sys
 import os
+import sys
+import time
 
-CHUNK_SIZE = 1000
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import fec
+from common.client import TransferError, UDPClient
+from common.secure import load_psk
 
-def run_put(sock, server_addr, filename):
+USAGE = "Usage: python clientUDP.py <ServerPort> <ServerIP> [fec[:<k>[:<r>]]] [psk=<key file>]"
+
+def run_put(client, filename):
     if not os.path.exists(filename):
         print(f"[-] File '{filename}' does not exist.")
         return
 
+    result = client.put(filename)
+    if result.ok:
+        print(f"[+] {result.message}")
+    else:
+        print(f"[-] Error in put: {result.message}")
+
+def run_get(client, filename):
+    result = client.get(filename)
+    if result.ok:
+        print(f"[*] Received {result.nbytes} bytes.")
+        print(f"[+] {result.message}")
+    else:
+        print(f"[-] Error in get: {result.message}")
+
+def run_list(client, prefix):
     try:
-        # Send the put command
-        command = f"put {filename}"
-        sock.sendto(command.encode(), server_addr)
-
-        # Wait for Ack 0 from server confirming command
-        data, addr = sock.recvfrom(1024)
-        if addr != server_addr or data.decode() != "Ack 0":
-            print("[-] Server did not acknowledge put command properly.")
-            return
-
-        filesize = os.path.getsize(filename)
-        # Send LEN:<filesize>
-        sock.sendto(f"LEN:{filesize}".encode(), server_addr)
-
-        # Send file in chunks, wait for ACK after each
-        with open(filename, 'rb') as f:
-            bytes_sent = 0
-            while bytes_sent < filesize:
-                chunk = f.read(CHUNK_SIZE)
-                sock.sendto(chunk, server_addr)
-
-                data, addr = sock.recvfrom(1024)
-                if addr != server_addr or data.decode() != "ACK":
-                    print("[-] Did not receive ACK for chunk. Aborting.")
-                    return
-                bytes_sent += len(chunk)
-
-        # Wait for FIN from server
-        data, addr = sock.recvfrom(1024)
-        if addr == server_addr and data.decode() == "FIN":
-            print("[+] File successfully uploaded.")
-            # Send final Ack 1 to confirm finish
-            sock.sendto(b"Ack 1", server_addr)
-        else:
-            print("[-] Did not receive FIN from server.")
-
-    except Exception as e:
-        print(f"[-] Error in put: {e}")
-
-def run_get(sock, server_addr, filename):
+        count = 0
+        for info in client.list_all(prefix):
+            print(f"    {info.name}  {info.size} bytes")
+            count += 1
+        print(f"[+] {count} file(s) stored.")
+    except (OSError, TransferError) as e:
+        print(f"[-] Error in list: {e}")
+
+def run_stat(client, filename):
     try:
-        # Send get command
-        command = f"get {filename}"
-        sock.sendto(command.encode(), server_addr)
-
-        # Wait for server response
-        data, addr = sock.recvfrom(4096)
-        if addr != server_addr:
-            print("[-] Received response from unknown sender.")
-            return
-
-        response = data.decode()
-        if response == "File not found":
-            print(f"[-] Server could not find file '{filename}'.")
-            return
-        elif response != "Ack 0":
-            print("[-] Unexpected server response.")
-            return
-
-        # Receive LEN:<filesize>
-        len_data, addr = sock.recvfrom(1024)
-        if addr != server_addr or not len_data.decode().startswith("LEN:"):
-            print("[-] Did not receive expected length info.")
-            return
-
-        filesize = int(len_data.decode().split(":")[1])
-        print(f"[*] Expecting {filesize} bytes.")
-
-        # Send ACK for LEN message
-        sock.sendto(b"ACK", server_addr)
-
-        # Receive file chunks, send ACK after each
-        bytes_received = 0
-        save_name = f"downloaded_{filename}"
-        with open(save_name, 'wb') as f:
-            while bytes_received < filesize:
-                chunk, addr = sock.recvfrom(CHUNK_SIZE + 100)
-                if addr != server_addr:
-                    print(f"[!] Ignored packet from unknown sender {addr}")
-                    continue
-                f.write(chunk)
-                bytes_received += len(chunk)
-                sock.sendto(b"ACK", server_addr)
-
-        # Receive FIN from server
-        fin_data, addr = sock.recvfrom(1024)
-        if addr == server_addr and fin_data.decode() == "FIN":
-            print(f"[+] File downloaded and saved as {save_name}")
-            # ✅ Send final acknowledgment
-            sock.sendto(b"Ack 1", server_addr)
-            print("[+] Final acknowledgment sent to server.")
-        else:
-            print("[-] Did not receive FIN from server.")
-
-    except Exception as e:
-        print(f"[-] Error in get: {e}")
+        info = client.stat(filename)
+    except (OSError, TransferError) as e:
+        print(f"[-] Error in stat: {e}")
+        return
+    if info is None:
+        print(f"[-] Server has no file '{filename}'.")
+        return
+    print(f"[+] {info.name}: {info.size} bytes, modified {time.ctime(info.mtime)}, "
+          f"sha256 {info.digest or 'unknown'}")
 
-def command_loop(sock, server_addr):
+def command_loop(client):
     while True:
-        command_line = input("Enter HTTP request (put/get/quit): ").strip()
+        command_line = input("Enter HTTP request (put/get/list/stat/quit): ").strip()
         if not command_line:
             continue
 
@@ -151,36 +101,57 @@ def command_loop(sock, server_addr):
             print("Closing client.")
             break
 
+        if command == "list" and len(parts) <= 2:
+            run_list(client, parts[1] if len(parts) == 2 else "")
+            continue
+
         if len(parts) != 2:
-            print("Usage:\n  put <filename>\n  get <filename>\n  quit")
+            print("Usage:\n  put <filename>\n  get <filename>\n  list [prefix]\n"
+                  "  stat <filename>\n  quit")
             continue
 
         filename = parts[1]
 
         if command == "put":
-            run_put(sock, server_addr, filename)
+            run_put(client, filename)
         elif command == "get":
-            run_get(sock, server_addr, filename)
+            run_get(client, filename)
+        elif command == "stat":
+            run_stat(client, filename)
         else:
-            print("Unknown command. Use put, get, or quit.")
+            print("Unknown command. Use put, get, list, stat, or quit.")
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python clientUDP.py <ServerPort> <ServerIP>")
+    if len(sys.argv) < 3:
+        print(USAGE)
         sys.exit(1)
 
     server_port = int(sys.argv[1])
     server_ip = sys.argv[2]
-    server_addr = (server_ip, server_port)
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Optional settings: fec[:<k>[:<r>]] and psk=<key file>, in any order
+    fec_option = None
+    psk = None
+    try:
+        for option in sys.argv[3:]:
+            if option.startswith("psk="):
+                psk = load_psk(option[4:])
+            else:
+                fec_option = fec.parse_option(option)
+                if fec_option is None:
+                    raise ValueError(f"Unknown option '{option}'")
+    except (OSError, ValueError) as e:
+        print(f"[-] {e}")
+        print(USAGE)
+        sys.exit(1)
+
+    client = UDPClient(server_ip, server_port, fec_option=fec_option, psk=psk)
     print(f"[+] UDP client started. Sending to {server_ip}:{server_port}")
 
     try:
-        command_loop(sock, server_addr)
+        command_loop(client)
     finally:
-        sock.close()
+        client.close()
 
 if __name__ == "__main__":
     main()
-
@@ -8,58 +8,392 @@ to/from clients using simple commands (`put`, `get`). The server uses a
 stop-and-wait protocol to ensure reliable data transfer over UDP.
 
 Usage:
-    python serverUDP.py <Port>
+    python serverUDP.py <Port> [--storage cas|dir] [--storage-root <dir>]
+                        [--global-rate B/s] [--client-rate B/s] [--session-rate B/s]
+                        [--limits-file <json>] [--psk-file <key file>]
+                        [--recv-window <bytes>] [--max-sessions N]
+                        [--max-client-sessions N] [--max-client-buffer BYTES]
+                        [--read-timeout S] [--socket-buffer BYTES]
+                        [--timings] [--profile-dir <dir>]
     Example:
         python serverUDP.py 12345
 
 Commands:
-    - put <filename> : Client uploads a file to the server.
-    - get <filename> : Client requests a file download from the server.
+    - put <filename> [fec]              : Client uploads a file to the server.
+    - get <filename> [fec[:<k>[:<r>]]]  : Client requests a file download from the server.
+
+    - stat <filename>                   : Client asks for a stored file's size, mtime and hash.
+    - list [<prefix>] [limit=<n>] [after=<cursor>]
+                                        : Client asks for a page of its files, in name order.
+
+    The optional `fec` switches the data phase to forward error correction mode
+    (common/fec.py): blocks of k chunks plus r XOR parity chunks, one ACK per block.
+
+    `stat` and `list` are answered straight from the main loop with a single
+    datagram, from the storage layer's in-memory index (common/index.py). A
+    `list` page is cut short to fit in MAX_LISTING_BYTES; the client resends
+    the command if the reply is lost.
 
 Behavior:
-    - Files uploaded by clients are saved in directories named after
-      their IP addresses (e.g., uploads_127_0_0_1).
+    - Files uploaded by clients are stored per client IP address through the
+      shared storage layer (common/storage.py), the same one serverTCP.py uses.
+      `get` only serves files from the requesting client's namespace.
     - File transfers are chunked (1000 bytes) and require ACKs.
+    - Uploads are buffered in a bounded ring that a writer thread drains to
+      disk; every ACK advertises the free space so a client never overruns
+      a slow disk (common/flow.py). Downloads honour the client's window.
     - The server responds with FIN to signal successful upload/download completion.
+    - Several clients can transfer at once. The main loop routes each datagram
+      to a per-client session thread by sender address; a datagram from an
+      address with no session is treated as a new command.
+    - Transfers are paced by the shared bandwidth scheduler (common/scheduler.py).
+    - With --psk-file every datagram is encrypted and authenticated
+      (common/secure.py); datagrams that fail authentication are dropped.
+    - Sessions are admitted by common/limits.py: commands over the session
+      or per-client buffer caps get "Server busy". Each session queues at
+      most INBOX_BYTES of datagrams. A session that hears nothing from its
+      client for --read-timeout seconds expires and its partial upload is
+      discarded.
+    - --timings prints each transfer's phase breakdown and per-chunk step
+      shares (recv, ack_wait, disk_read, ...), and the totals across
+      transfers on Ctrl-C. --profile-dir also runs transfers under cProfile
+      and writes one report per transfer (common/timing.py).
 
 References:
     https://realpython.com/python-sockets/
 """
 
+import argparse
+import os
+import queue
 import socket
 import sys
-import os
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import fec, flow, index, limits, timing
+from common.scheduler import BandwidthScheduler, watch_limits_file
+from common.secure import SecureDatagramSocket, load_psk
+from common.storage import BACKENDS, open_storage
 
 CHUNK_SIZE = 1000
+MAX_LOSS_ESTIMATORS = 4096
+INBOX_BYTES = 256 * 1024  # datagrams queued per session
+MAX_LISTING_BYTES = 8 * 1024  # largest `list` reply; bigger datagrams fragment
+
+class ClientSession:
+    """
+    Stands in for the server socket while one client's command is handled.
+
+    It has the same recvfrom/sendto/settimeout methods as a UDP socket, but
+    recvfrom only returns datagrams that the main loop delivered for this
+    client's address. At most INBOX_BYTES of datagrams wait in its queue;
+    datagrams beyond that are dropped, as a full socket buffer would.
+    """
+
+    def __init__(self, sock, addr, lease, timeout=None):
+        self.sock = sock
+        self.addr = addr
+        self.lease = lease  # limits.Lease admitting this session
+        self.inbox = queue.Queue()
+        self.queued = 0
+        self.queued_lock = threading.Lock()
+        self.timeout = timeout
+
+    def _dequeued(self, data):
+        with self.queued_lock:
+            self.queued -= len(data)
+
+    def deliver(self, data):
+        with self.queued_lock:
+            if self.queued + len(data) > INBOX_BYTES:
+                return
+            self.queued += len(data)
+        self.inbox.put(data)
+
+    def drain(self):
+        """Returns the datagrams that were delivered but never read."""
+        leftover = []
+        while True:
+            try:
+                data = self.inbox.get_nowait()
+            except queue.Empty:
+                return leftover
+            self._dequeued(data)
+            leftover.append(data)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def recvfrom(self, bufsize):
+        try:
+            data = self.inbox.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+        self._dequeued(data)
+        return data[:bufsize], self.addr
+
+    def sendto(self, data, addr):
+        return self.sock.sendto(data, addr)
+
+class Dispatcher:
+    """
+    Routes datagrams from the server socket to client sessions and runs each
+    session's command in its own thread.
+    """
+
+    def __init__(self, sock, store, scheduler, window=flow.DEFAULT_WINDOW, governor=None,
+                 read_timeout=60.0, instruments=None):
+        self.sock = sock
+        self.store = store
+        self.scheduler = scheduler
+        self.window = window  # receive buffer per upload, advertised in ACKs
+        self.governor = governor or limits.ResourceGovernor()
+        self.read_timeout = read_timeout  # sessions expire after this much silence
+        self.instruments = instruments or timing.Instrumentation()
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.loss_estimators = {}  # client IP -> fec.LossEstimator for FEC downloads
+
+    def dispatch(self, data, client_addr):
+        with self.lock:
+            session = self.sessions.get(client_addr)
+            if session is not None:
+                session.deliver(data)
+                return
+
+            if fec.is_fec_packet(data):
+                return  # Late block from a finished FEC transfer
 
-def save_file_directory(client_ip):
-    dir_name = f"uploads_{client_ip.replace(':', '_')}"
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-    return dir_name
+            message = data.decode(errors="replace").strip()
+            print(f"[+] Received from {client_addr}: {message[:80]}")
+
+            # Queries need no session: answer them from the index right away
+            parts = message.split()
+            if parts and parts[0].lower() in ("list", "stat"):
+                self.sock.sendto(self.query(parts, client_addr[0]), client_addr)
+                return
 
-def receive_file(sock, expected_size, addr, save_path):
+            # Filter out non-command messages like "Ack 1"
+            if len(parts) < 2 or parts[0].lower() not in ["put", "get"]:
+                print("[-] Invalid or unrecognized command. Ignored.")
+                return
+
+            try:
+                fec_option = parse_options(parts[2:])
+            except ValueError as e:
+                print(f"[-] {e}. Ignored.")
+                return
+
+            # Every session may queue INBOX_BYTES; uploads also hold a receive window
+            buffered = INBOX_BYTES + (self.window if parts[0].lower() == "put" else 0)
+            try:
+                lease = self.governor.admit(client_addr[0], buffered)
+            except limits.LimitExceeded as e:
+                print(f"[-] Refused {client_addr}: {e}")
+                self.sock.sendto(limits.BUSY_MESSAGE, client_addr)
+                return
+
+            session = ClientSession(self.sock, client_addr, lease, self.read_timeout)
+            self.sessions[client_addr] = session
+
+        threading.Thread(target=self.run_session,
+                         args=(session, parts[0].lower(), parts[1], fec_option, data),
+                         daemon=True).start()
+
+    def run_session(self, session, command, filename, fec_option, command_text):
+        client_addr = session.addr
+        transfer = self.scheduler.session(client_addr[0])
+        timer = self.instruments.start(f"{command} {filename} {client_addr[0]}:{client_addr[1]}")
+        try:
+            if command == "put" and fec_option is None:
+                handle_put(session, self.store, filename, client_addr, transfer, self.window,
+                           timer)
+            elif command == "put":
+                handle_put_fec(session, self.store, filename, client_addr, transfer, command_text,
+                               self.window, timer)
+            elif fec_option is None:
+                handle_get(session, self.store, filename, client_addr, transfer, timer)
+            else:
+                estimator = self.loss_estimator(client_addr[0])
+                handle_get_fec(session, self.store, filename, client_addr, transfer,
+                               command_text, fec_option, estimator, timer)
+        except Exception as e:
+            print(f"[-] Error handling {command} from {client_addr}: {e}")
+        finally:
+            self.instruments.finish(timer)
+            transfer.close()
+            with self.lock:
+                del self.sessions[client_addr]
+                leftover = session.drain()
+                session.lease.close()
+            # Anything the client sent after this command finished starts a new one
+            for data in leftover:
+                self.dispatch(data, client_addr)
+
+    def query(self, parts, client_ip):
+        """Returns the reply to a `list` or `stat` command."""
+        if parts[0].lower() == "stat":
+            info = self.store.stat(client_ip, parts[1]) if len(parts) == 2 else None
+            return index.format_stat(info) if info else b"File not found"
+        try:
+            prefix, after, limit = index.parse_list_options(parts[1:])
+        except ValueError as e:
+            return f"Error: {e}".encode()
+        return index.format_listing(self.store.list(client_ip, prefix, after, limit),
+                                    MAX_LISTING_BYTES)
+
+    def loss_estimator(self, client_ip):
+        """The client's LossEstimator; only the most recent clients' are kept."""
+        with self.lock:
+            estimator = self.loss_estimators.pop(client_ip, None) or fec.LossEstimator()
+            self.loss_estimators[client_ip] = estimator
+            if len(self.loss_estimators) > MAX_LOSS_ESTIMATORS:
+                del self.loss_estimators[next(iter(self.loss_estimators))]
+            return estimator
+
+def parse_options(tokens):
+    """Returns the FEC (k, r) requested by a command's options, or None for plain mode."""
+    for token in tokens:
+        option = fec.parse_option(token)
+        if option is not None:
+            return option
+    return None
+
+def receive_file(sock, expected_size, addr, writer, transfer, window, timer=timing.NULL_TIMER):
+    """Receives an upload into `writer`. Returns True if it was stored."""
+    ring = flow.RingBuffer(timer.wrap_writes(writer), window)
     try:
+        timer.phase("data")
         bytes_received = 0
-        with open(save_path, 'wb') as f:
-            while bytes_received < expected_size:
-                data, sender = sock.recvfrom(CHUNK_SIZE + 100)
-                if sender != addr:
-                    print(f"[!] Ignored packet from unknown sender {sender}")
-                    continue
-                f.write(data)
-                bytes_received += len(data)
-                sock.sendto(b"ACK", addr)  # ACK for chunk
-
-        # Send FIN after all bytes received
+        update = None
+        while bytes_received < expected_size:
+            data = flow.receive(sock, addr, CHUNK_SIZE + 100, update)
+            timer.lap("recv")
+            update = None
+            ring.write(data)  # The writer thread puts it on disk
+            timer.lap("ring_write")
+            bytes_received += len(data)
+            transfer.acquire(len(data))  # Hold the ACK back if over the rate limit
+            timer.lap("pacing")
+            free = ring.free()
+            sock.sendto(f"ACK {free}".encode(), addr)  # ACK for chunk, with window
+            timer.lap("ack_send")
+
+            # Window too small for the next chunk: wait for the disk, then reopen it
+            needed = min(CHUNK_SIZE, expected_size - bytes_received)
+            if needed and free < needed:
+                update = flow.hold_window(sock, addr, ring, needed)
+                timer.lap("window_hold")
+
+        # Store the file, then send FIN after all bytes received
+        timer.phase("flush")
+        ring.close()
+        timer.phase("commit")
+        writer.commit()
+        timer.phase("finish")
         sock.sendto(b"FIN", addr)
-        print(f"[+] File received and saved as {save_path}")
+        print(f"[+] File received and stored ({bytes_received} bytes)")
+        return True
 
     except Exception as e:
+        ring.abort()
+        writer.discard()
         print(f"[-] Error receiving file: {e}")
+        return False
+
+def receive_file_fec(sock, expected_size, addr, writer, transfer, window,
+                     timer=timing.NULL_TIMER):
+    """
+    FEC mode version of receive_file. Returns the messages to repeat if the
+    client resends its last block (the final BACK and FIN), or None on failure.
+    """
+    ring = flow.RingBuffer(timer.wrap_writes(writer), window)
+    try:
+        timer.phase("data")
+        last_back = fec.receive_file(sock, addr, ring, expected_size, CHUNK_SIZE,
+                                     acquire=transfer.acquire, idle_timeout=sock.gettimeout(),
+                                     replies={b"LEN:": [b"ACK"]}, timer=timer)
+
+        # Store the file, then send FIN after all bytes received
+        timer.phase("flush")
+        ring.close()
+        timer.phase("commit")
+        writer.commit()
+        timer.phase("finish")
+        sock.sendto(b"FIN", addr)
+        print(f"[+] File received and stored ({expected_size} bytes, FEC)")
+        return [last_back, b"FIN"]
+
+    except Exception as e:
+        ring.abort()
+        writer.discard()
+        print(f"[-] Error receiving file: {e}")
+        return None
+
+def handle_put(sock, store, filename, client_addr, transfer, window, timer=timing.NULL_TIMER):
+    # Step 1: Acknowledge the put command
+    timer.phase("handshake")
+    sock.sendto(b"Ack 0", client_addr)
+
+    # Step 2: Receive LEN:<filesize>
+    len_data, addr = sock.recvfrom(1024)
+    if addr != client_addr or not len_data.decode().startswith("LEN:"):
+        print("[-] Invalid LEN from client.")
+        return
 
-def handle_get(sock, filename, client_addr):
-    if not os.path.exists(filename):
+    filesize = int(len_data.decode().split(":")[1])
+    print(f"[*] Expecting {filesize} bytes from client.")
+
+    # Step 3: Receive the file into the client's namespace
+    writer = store.writer(client_addr[0], filename)
+    if not receive_file(sock, filesize, client_addr, writer, transfer, window, timer):
+        return
+
+    # Step 4: Wait for Ack 1 from client
+    data, addr = sock.recvfrom(1024)
+    if addr == client_addr and data.decode() == "Ack 1":
+        print(f"[+] Upload of {filename} complete.")
+    else:
+        print("[-] Upload did not complete cleanly.")
+
+def handle_put_fec(sock, store, filename, client_addr, transfer, command_text, window,
+                   timer=timing.NULL_TIMER):
+    """
+    put in FEC mode. Same steps as handle_put, but the LEN is ACKed and every
+    control message is repeated until the client's next one arrives.
+    """
+    # Step 1: Acknowledge the put command (again if the client repeats it)
+    timer.phase("handshake")
+    sock.sendto(b"Ack 0", client_addr)
+
+    # Step 2: Receive LEN:<filesize> and ACK it
+    len_data = fec.expect(sock, client_addr, (b"LEN:",), replies={command_text: [b"Ack 0"]},
+                          resend=[b"Ack 0"], rto=1.0)
+    filesize = int(len_data.decode().split(":")[1])
+    sock.sendto(b"ACK", client_addr)
+    print(f"[*] Expecting {filesize} bytes from client (FEC).")
+
+    # Step 3: Receive the blocks into the client's namespace
+    writer = store.writer(client_addr[0], filename)
+    resend = receive_file_fec(sock, filesize, client_addr, writer, transfer, window, timer)
+    if resend is None:
+        return
+
+    # Step 4: Wait for Ack 1, repeating the last BACK and FIN until it arrives
+    try:
+        fec.expect(sock, client_addr, (b"Ack 1",), resend=resend, rto=1.0, retries=5)
+        print(f"[+] Upload of {filename} complete.")
+    except TimeoutError:
+        print("[-] Upload did not complete cleanly.")
+
+def handle_get(sock, store, filename, client_addr, transfer, timer=timing.NULL_TIMER):
+    timer.phase("handshake")
+    f = store.open(client_addr[0], filename)
+    if f is None:
         sock.sendto(b"File not found", client_addr)
         print(f"[-] File {filename} not found.")
         return
@@ -68,31 +402,49 @@ def handle_get(sock, filename, client_addr):
     sock.sendto(b"Ack 0", client_addr)
 
     # Step 2: Send LEN:<filesize>
-    filesize = os.path.getsize(filename)
+    filesize = os.fstat(f.fileno()).st_size
     sock.sendto(f"LEN:{filesize}".encode(), client_addr)
 
     # Step 3: Wait for client ACK on length
-    data, addr = sock.recvfrom(1024)
-    if addr != client_addr or data.decode() != "ACK":
+    data = flow.receive(sock, client_addr, 1024)
+    try:
+        window = flow.ack_window(data)
+    except ValueError:
         print("[-] Client did not ACK file length.")
+        f.close()
         return
 
-    # Step 4: Send chunks with stop-and-wait
-    with open(filename, 'rb') as f:
+    # Step 4: Send chunks with stop-and-wait, never more than the client's window
+    timer.phase("data")
+    with f:
         bytes_sent = 0
         while bytes_sent < filesize:
             chunk = f.read(CHUNK_SIZE)
+            timer.lap("disk_read")
+            if window is not None and window < len(chunk):
+                window = flow.wait_for_window(
+                    lambda: flow.receive(sock, client_addr, 1024), window, len(chunk))
+                timer.lap("window_wait")
+            transfer.acquire(len(chunk))
+            timer.lap("pacing")
             sock.sendto(chunk, client_addr)
-
-            # Wait for ACK
-            data, addr = sock.recvfrom(1024)
-            if addr != client_addr or data.decode() != "ACK":
+            timer.lap("send")
+
+            # Wait for ACK, skipping repeated window updates
+            data = flow.receive(sock, client_addr, 1024)
+            while data.startswith(b"WIN"):
+                data = flow.receive(sock, client_addr, 1024)
+            timer.lap("ack_wait")
+            try:
+                window = flow.ack_window(data)
+            except ValueError:
                 print("[-] Client did not ACK chunk. Aborting.")
                 return
 
             bytes_sent += len(chunk)
 
     # Step 5: Send FIN to signal completion
+    timer.phase("finish")
     sock.sendto(b"FIN", client_addr)
 
     # Step 6: Wait for Ack 1
@@ -102,59 +454,107 @@ def handle_get(sock, filename, client_addr):
     else:
         print("[-] Did not receive final Ack 1 from client.")
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python serverUDP.py <Port>")
-        sys.exit(1)
+def handle_get_fec(sock, store, filename, client_addr, transfer, command_text,
+                   fec_option, estimator, timer=timing.NULL_TIMER):
+    """
+    get in FEC mode. Same steps as handle_get, but the data is sent in blocks
+    with parity and every control message is repeated until answered.
+    """
+    timer.phase("handshake")
+    f = store.open(client_addr[0], filename)
+    if f is None:
+        sock.sendto(b"File not found", client_addr)
+        print(f"[-] File {filename} not found.")
+        return
 
-    server_port = int(sys.argv[1])
+    with f:
+        # Steps 1-3: Ack 0 and LEN:<filesize>, repeated until the client ACKs the length
+        filesize = os.fstat(f.fileno()).st_size
+        handshake = [b"Ack 0", f"LEN:{filesize}".encode()]
+        for message in handshake:
+            sock.sendto(message, client_addr)
+        fec.expect(sock, client_addr, (b"ACK",), replies={command_text: handshake},
+                   resend=handshake[1:], rto=1.0)
+
+        # Step 4: Send blocks of chunks plus parity, one ACK per block
+        timer.phase("data")
+        k, r = fec_option
+        fec.send_file(sock, client_addr, f, filesize, CHUNK_SIZE, k, r,
+                      estimator=estimator, acquire=transfer.acquire, timer=timer)
+
+    # Steps 5-6: Send FIN until the client answers with Ack 1
+    timer.phase("finish")
+    try:
+        fec.request(sock, client_addr, b"FIN", (b"Ack 1",), rto=1.0, retries=5)
+        print(f"[+] File {filename} delivered successfully (FEC).")
+    except TimeoutError:
+        print("[-] Did not receive final Ack 1 from client.")
+
+def main():
+    limits.raise_fd_limit()
+    parser = argparse.ArgumentParser(description="UDP file server")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--storage", choices=sorted(BACKENDS), default="cas",
+                        help="storage backend (default: cas)")
+    parser.add_argument("--storage-root", default="uploads",
+                        help="directory holding stored files (default: uploads)")
+    parser.add_argument("--global-rate", type=int, help="total egress cap in bytes/s")
+    parser.add_argument("--client-rate", type=int, help="per-client-IP cap in bytes/s")
+    parser.add_argument("--session-rate", type=int, help="per-transfer cap in bytes/s")
+    parser.add_argument("--limits-file", help="JSON file with limits, reloaded on change")
+    parser.add_argument("--psk-file", help="pre-shared key file; enables encrypted datagrams")
+    parser.add_argument("--recv-window", type=int, default=flow.DEFAULT_WINDOW,
+                        help=f"receive buffer per upload in bytes (default {flow.DEFAULT_WINDOW})")
+    # A UDP session holds only the stored file; all share the server socket
+    parser.add_argument("--max-sessions", type=int, default=limits.default_max_sessions(1),
+                        help="transfers served at once (default %(default)s, "
+                             "from the descriptor limit)")
+    parser.add_argument("--max-client-sessions", type=int,
+                        default=limits.DEFAULT_MAX_CLIENT_SESSIONS,
+                        help="transfers served at once per client IP (default %(default)s)")
+    parser.add_argument("--max-client-buffer", type=int, default=limits.DEFAULT_MAX_CLIENT_BYTES,
+                        help="buffer bytes per client IP (default %(default)s)")
+    parser.add_argument("--socket-buffer", type=int, default=4 * 1024 * 1024,
+                        help="receive buffer of the server socket in bytes (default %(default)s)")
+    parser.add_argument("--read-timeout", type=float, default=60.0,
+                        help="seconds of client silence before a session expires "
+                             "(default %(default)s)")
+    parser.add_argument("--timings", action="store_true",
+                        help="print a phase and step breakdown of every transfer")
+    parser.add_argument("--profile-dir",
+                        help="run transfers under cProfile, writing one report per transfer here")
+    args = parser.parse_args()
+
+    store = open_storage(args.storage, args.storage_root)
+    removed = store.remove_partial_uploads()
+    if removed:
+        print(f"[*] Removed {removed} abandoned partial uploads")
+    governor = limits.ResourceGovernor(args.max_sessions, args.max_client_sessions,
+                                       args.max_client_buffer)
+    scheduler = BandwidthScheduler(args.global_rate, args.client_rate, args.session_rate)
+    if args.limits_file:
+        watch_limits_file(scheduler, args.limits_file)
+
+    server_port = args.port
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # All clients share this socket; a small buffer drops datagrams under load
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.socket_buffer)
     sock.bind(('', server_port))
-    print(f"[+] UDP Server listening on port {server_port}")
-
-    while True:
-        print("[*] Waiting for client command...")
-        data, client_addr = sock.recvfrom(4096)
-        message = data.decode().strip()
-        print(f"[+] Received from {client_addr}: {message}")
-
-        # Filter out non-command messages like "Ack 1"
-        parts = message.split()
-        if len(parts) < 2 or parts[0].lower() not in ["put", "get"]:
-            print("[-] Invalid or unrecognized command. Ignored.")
-            continue
-
-        command = parts[0].lower()
-        filename = parts[1]
-
-        if command == "put":
-            # Step 1: Acknowledge the put command
-            sock.sendto(b"Ack 0", client_addr)
-
-            # Step 2: Receive LEN:<filesize>
-            len_data, addr = sock.recvfrom(1024)
-            if addr != client_addr or not len_data.decode().startswith("LEN:"):
-                print("[-] Invalid LEN from client.")
-                continue
-
-            filesize = int(len_data.decode().split(":")[1])
-            print(f"[*] Expecting {filesize} bytes from client.")
-
-            # Step 3: Prepare file path and receive file
-            save_dir = save_file_directory(client_addr[0])
-            save_path = os.path.join(save_dir, filename)
-            receive_file(sock, filesize, client_addr, save_path)
-
-            # Step 4: Wait for Ack 1 from client
-            data, addr = sock.recvfrom(1024)
-            if addr == client_addr and data.decode() == "Ack 1":
-                print(f"[+] Upload of {filename} complete.")
-            else:
-                print("[-] Upload did not complete cleanly.")
-
-        elif command == "get":
-            handle_get(sock, filename, client_addr)
+    if args.psk_file:
+        sock = SecureDatagramSocket(sock, load_psk(args.psk_file), server=True)
+    print(f"[+] UDP Server listening on port {server_port}{' (encrypted)' if args.psk_file else ''}")
+
+    instruments = timing.Instrumentation(args.timings, args.profile_dir)
+    dispatcher = Dispatcher(sock, store, scheduler, args.recv_window, governor,
+                            args.read_timeout, instruments)
+    print("[*] Waiting for client commands...")
+    try:
+        while True:
+            data, client_addr = sock.recvfrom(4096)
+            dispatcher.dispatch(data, client_addr)
+    except KeyboardInterrupt:
+        if instruments.enabled:
+            print(instruments.report())
 
 if __name__ == "__main__":
     main()
-
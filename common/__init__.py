@@ -0,0 +1,7 @@
+"""
+Authors: Chinwe Ofonagoro, Vincent Jiang
+Purpose: Code shared by the TCP (PartOne) and UDP (PartTwo) file transfer programs.
+
+The scripts in PartOne/ and PartTwo/ add the repository root to sys.path so
+they can import this package when run directly (IE: python serverTCP.py 12345).
+"""
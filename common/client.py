@@ -0,0 +1,619 @@
+"""
+Purpose: Importable client library for the TCP and UDP file servers.
+
+The interactive clients (PartOne/clientTCP.py, PartTwo/ClientUDP.py) and the
+non-interactive CLI (tools/transfer.py) are thin wrappers around these classes.
+Every operation returns a TransferResult instead of printing, so scripts can
+drive many transfers and inspect the outcome of each one.
+
+Usage:
+    client = UDPClient("127.0.0.1", 12345)
+    result = client.put("file1.txt")
+    if result.ok:
+        print(result.nbytes, result.elapsed)
+
+    results = client.batch([("put", "a.txt"), ("get", "b.txt")], workers=8)
+
+    info = client.stat("a.txt")              # FileInfo, or None if not stored
+    for info in client.list_all("log-"):     # fetched a page at a time
+        print(info.name, info.size)
+
+    async with AsyncClient(TCPClient("127.0.0.1", 12345)) as aclient:
+        results = await aclient.batch([("get", "a.txt")] * 100)
+
+One client object may be used from many threads at once. TCP transfers each
+open their own connection (the server closes it after one command); UDP
+transfers check a socket out of a pool, because the server tells transfers
+apart by the client's address and port. Each thread reuses one chunk buffer.
+
+TCPClient(..., ssl_context=client_tls_context(...)) talks TLS and resumes
+the previous TLS session on each new connection. UDPClient(..., psk=key)
+encrypts every datagram under one session key per client (common/secure.py).
+
+The `stat`/`list` queries are answered from the server's file index
+(common/index.py). Unlike put/get they return data, and they raise
+TransferError or OSError on failure.
+
+UDPClient(..., fec_option=(k, r)) runs the data phase in forward error
+correction mode (common/fec.py); r=None lets the parity adapt to the loss
+rate observed across this client's transfers.
+
+UDP downloads are written to disk by a separate thread through a ring buffer
+of `recv_window` bytes, whose free space is advertised to the server in every
+ACK; uploads never send more than the server's window (common/flow.py).
+
+Pass `instruments=timing.Instrumentation(timings=True)` to time the phases
+and per-chunk steps of every transfer, or `profile_dir=...` to profile them
+(common/timing.py). It is off by default.
+"""
+
+import asyncio
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from common import fec, flow, index, timing
+from common.limits import BUSY_MESSAGE
+from common.secure import SecureDatagramSocket
+
+TransferResult = namedtuple(
+    "TransferResult", ["command", "filename", "ok", "nbytes", "elapsed", "message"])
+
+TCP_CHUNK_SIZE = 64 * 1024
+UDP_CHUNK_SIZE = 1000
+EOF_MARKER = b"<EOF>"
+
+# Late duplicates from a pooled socket's previous transfer
+STALE_UDP_MESSAGES = (b"ACK", b"FIN", b"BACK", b"NAK", b"WIN", bytes([fec.MAGIC]))
+
+# UDP queries are resent after this many seconds without a reply
+QUERY_RTO = 1.0
+
+
+class TransferError(Exception):
+    """Raised inside a transfer when the server misbehaves; reported as a failed result."""
+
+
+def _check_busy(reply):
+    if reply.startswith(BUSY_MESSAGE):
+        raise TransferError("Server busy; try again later")
+
+
+class BaseClient:
+    """
+    Shared put/get/batch plumbing. Subclasses implement `_put` and `_get`,
+    which take a timer (common/timing.py) as their last argument and return
+    the number of bytes moved and a status message, or raise,
+    and `_query`, which sends a stat/list command and returns the reply.
+    """
+
+    def __init__(self, host, port, download_dir=".", bind_address=None, timeout=30.0,
+                 instruments=None):
+        self.server_addr = (host, int(port))
+        self.download_dir = download_dir
+        self.bind_address = bind_address
+        self.timeout = timeout
+        self.instruments = instruments or timing.Instrumentation()
+        self._local = threading.local()
+
+    def put(self, filename, remote_name=None):
+        """Uploads local `filename`, stored on the server as `remote_name`."""
+        remote_name = remote_name or os.path.basename(filename)
+        return self._run("put", filename, self._put, filename, remote_name)
+
+    def get(self, filename, save_as=None):
+        """Downloads `filename` into `save_as` (default downloaded_<filename>)."""
+        save_as = save_as or os.path.join(self.download_dir, f"downloaded_{filename}")
+        return self._run("get", filename, self._get, filename, save_as)
+
+    def stat(self, filename):
+        """Returns the FileInfo of a stored file, or None if it is not stored."""
+        reply = self._query(f"stat {filename}".encode())
+        if reply == b"File not found":
+            return None
+        if not reply.startswith(b"STAT "):
+            raise TransferError(f"Unexpected server response {reply[:40]!r}")
+        return index.parse_entry(reply[5:].decode())
+
+    def list(self, prefix="", after=None, limit=None):
+        """
+        Returns one page of stored files whose names start with `prefix`, as a
+        Listing. Pass its `next_after` as `after` to fetch the next page.
+        The server caps `limit` (and UDP replies must fit one datagram).
+        """
+        reply = self._query(index.format_list_command(prefix, after, limit))
+        if reply.startswith(b"Error: "):
+            raise TransferError(reply.decode(errors="replace"))
+        try:
+            return index.parse_listing(reply)
+        except ValueError as e:
+            raise TransferError(str(e)) from None
+
+    def list_all(self, prefix="", page_size=None):
+        """Yields the FileInfo of every stored file starting with `prefix`."""
+        after = None
+        while True:
+            listing = self.list(prefix, after, page_size)
+            yield from listing.entries
+            if listing.next_after is None:
+                return
+            after = listing.next_after
+
+    def run(self, command, filename):
+        """Runs one ("put" | "get", filename) command."""
+        if command == "put":
+            return self.put(filename)
+        if command == "get":
+            return self.get(filename)
+        return TransferResult(command, filename, False, 0, 0.0, f"Unknown command '{command}'")
+
+    def batch(self, commands, workers=8):
+        """
+        Runs an iterable of (command, filename) pairs with up to `workers`
+        transfers in flight. Commands on the same server file keep their
+        order (a put followed by a get of that file sees the upload).
+        Results are returned in the order given.
+        """
+        commands = list(commands)
+        if workers <= 1 or len(commands) <= 1:
+            return [self.run(cmd, name) for cmd, name in commands]
+
+        groups = {}
+        for i, (command, filename) in enumerate(commands):
+            remote = os.path.basename(filename) if command == "put" else filename
+            groups.setdefault(remote, []).append(i)
+
+        results = [None] * len(commands)
+
+        def run_group(indexes):
+            for i in indexes:
+                results[i] = self.run(*commands[i])
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(run_group, g) for g in groups.values()]:
+                future.result()
+        return results
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _buffer(self, size):
+        """Returns this thread's reusable chunk buffer."""
+        buf = getattr(self._local, "buf", None)
+        if buf is None or len(buf) < size:
+            buf = self._local.buf = bytearray(size)
+        return memoryview(buf)[:size]
+
+    def _run(self, command, filename, fn, *args):
+        start = time.perf_counter()
+        timer = self.instruments.start(f"{command} {filename}")
+        try:
+            nbytes, message = fn(*args, timer)
+            ok = True
+        except (OSError, TransferError, ValueError) as e:
+            nbytes, message, ok = 0, str(e) or e.__class__.__name__, False
+        finally:
+            self.instruments.finish(timer)
+        return TransferResult(command, filename, ok, nbytes,
+                              time.perf_counter() - start, message)
+
+
+class TCPClient(BaseClient):
+    """
+    Client for PartOne/serverTCP.py. With `ssl_context` every connection uses
+    TLS; `tls_resumed` counts the handshakes that resumed an earlier session.
+    """
+
+    def __init__(self, host, port, download_dir=".", bind_address=None, timeout=30.0,
+                 ssl_context=None, server_hostname=None, instruments=None):
+        super().__init__(host, port, download_dir, bind_address, timeout, instruments)
+        self.ssl_context = ssl_context
+        self.server_hostname = server_hostname or host
+        self.tls_session = None
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+
+    def _connect(self):
+        source = (self.bind_address, 0) if self.bind_address else None
+        sock = socket.create_connection(self.server_addr, timeout=self.timeout,
+                                        source_address=source)
+        # Commands and replies are small writes; don't hold them back
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ssl_context is None:
+            return sock
+        try:
+            return self.ssl_context.wrap_socket(sock, server_hostname=self.server_hostname,
+                                                session=self.tls_session)
+        except BaseException:
+            sock.close()
+            raise
+
+    def _finish(self, sock):
+        """Remembers the TLS session for resumption. Call after the server's reply
+        has been read (TLS 1.3 tickets arrive after the handshake)."""
+        if self.ssl_context is None:
+            return
+        self.tls_handshakes += 1
+        if sock.session_reused:
+            self.tls_resumed += 1
+        if sock.session is not None:
+            self.tls_session = sock.session
+
+    def _put(self, filename, remote_name, timer):
+        buf = self._buffer(TCP_CHUNK_SIZE)
+        timer.phase("handshake")
+        with open(filename, "rb") as f, self._connect() as sock:
+            # The size goes up front; the server reads exactly that many bytes
+            filesize = os.fstat(f.fileno()).st_size
+            sock.sendall(f"put {remote_name} {filesize}".encode())
+            reply = sock.recv(1024)
+            _check_busy(reply)
+            if reply != b"Ack 0":
+                raise TransferError("Server did not acknowledge put command")
+
+            timer.phase("data")
+            nbytes = 0
+            while nbytes < filesize:
+                n = f.readinto(buf[:filesize - nbytes])
+                timer.lap("disk_read")
+                if not n:
+                    raise TransferError(f"{filename} shrank during upload")
+                sock.sendall(buf[:n])
+                timer.lap("send")
+                nbytes += n
+            timer.phase("finish")
+
+            # "Ack 1 <bytes received>"
+            reply = sock.recv(1024).split()
+            if reply[:2] != [b"Ack", b"1"]:
+                raise TransferError("Server failed to confirm upload")
+            received = reply[2].decode() if len(reply) == 3 else "?"
+            if received != str(nbytes):
+                raise TransferError(f"Server received {received} of {nbytes} bytes")
+            self._finish(sock)
+        return nbytes, "File successfully uploaded."
+
+    def _get(self, filename, save_as, timer):
+        buf = self._buffer(TCP_CHUNK_SIZE)
+        timer.phase("handshake")
+        with self._connect() as sock:
+            sock.sendall(f"get {filename}".encode())
+
+            # "Ack 0" may arrive in the same segment as the first file bytes
+            reply = b""
+            while len(reply) < 5:
+                data = sock.recv(1024)
+                if not data:
+                    break
+                reply += data
+            _check_busy(reply)
+            if reply.startswith(b"File not"):
+                raise TransferError(f"Server could not find file '{filename}'")
+            if not reply.startswith(b"Ack 0"):
+                raise TransferError("Unexpected server response")
+            self._finish(sock)
+
+            # The server sends the file, then <EOF>, then closes the connection.
+            # Hold back the last few bytes so the marker is never written out.
+            pending = reply[5:]
+            nbytes = 0
+            timer.phase("data")
+            with open(save_as, "wb") as f:
+                while True:
+                    keep = len(pending) - len(EOF_MARKER)
+                    if keep > 0:
+                        f.write(pending[:keep])
+                        timer.lap("disk_write")
+                        nbytes += keep
+                        pending = pending[keep:]
+                    n = sock.recv_into(buf)
+                    timer.lap("recv")
+                    if not n:
+                        break
+                    pending += buf[:n]
+                if pending != EOF_MARKER:
+                    raise TransferError("Connection closed before end of file")
+        return nbytes, f"File delivered from server. Saved as {save_as}"
+
+    def _query(self, command):
+        # The server sends the whole reply, then closes the connection
+        with self._connect() as sock:
+            sock.sendall(command)
+            chunks = []
+            while True:
+                data = sock.recv(TCP_CHUNK_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+            self._finish(sock)
+        reply = b"".join(chunks)
+        _check_busy(reply)
+        return reply
+
+
+class UDPClient(BaseClient):
+    """
+    Client for PartTwo/ServerUDP.py: stop-and-wait with one ACK per chunk, or
+    FEC blocks with one ACK per block when `fec_option` is given.
+    """
+
+    def __init__(self, host, port, download_dir=".", bind_address=None, timeout=5.0,
+                 fec_option=None, psk=None, recv_window=flow.DEFAULT_WINDOW, instruments=None):
+        super().__init__(socket.gethostbyname(host), port, download_dir, bind_address, timeout,
+                         instruments)
+        self.fec_option = fec_option
+        self.recv_window = recv_window
+        self.psk = psk
+        self.loss_estimator = fec.LossEstimator()
+        self._pool = []
+        self._pool_lock = threading.Lock()
+
+    def _acquire_socket(self):
+        with self._pool_lock:
+            sock = self._pool.pop() if self._pool else None
+        if sock is not None:
+            self._drain(sock)
+            return sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.bind_address or "", 0))
+        sock.settimeout(self.timeout)
+        if self.psk:
+            # Each socket has its own key id, and so its own nonce counter and replay window
+            sock = SecureDatagramSocket(sock, self.psk)
+        return sock
+
+    def _release_socket(self, sock, healthy):
+        # A socket left mid-transfer may still receive stale datagrams
+        if not healthy:
+            sock.close()
+            return
+        with self._pool_lock:
+            self._pool.append(sock)
+
+    def _drain(self, sock):
+        """Discards datagrams that arrived after the socket's last transfer."""
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recvfrom(65536)
+        except BlockingIOError:
+            pass
+        finally:
+            sock.settimeout(self.timeout)
+
+    def close(self):
+        with self._pool_lock:
+            for sock in self._pool:
+                sock.close()
+            self._pool = []
+
+    def _expect(self, sock, bufsize, expected=None, skip=()):
+        """
+        Receives the next datagram from the server, ignoring other senders
+        and datagrams starting with any prefix in `skip`.
+        """
+        while True:
+            data, addr = sock.recvfrom(bufsize)
+            if addr != self.server_addr or (skip and data.startswith(skip)):
+                continue
+            _check_busy(data)
+            if expected is not None and data != expected:
+                raise TransferError(f"Expected {expected.decode()}, got {data[:40]!r}")
+            return data
+
+    def _with_socket(self, fn, *args):
+        sock = self._acquire_socket()
+        healthy = False
+        try:
+            result = fn(sock, *args)
+            healthy = True
+            return result
+        finally:
+            self._release_socket(sock, healthy)
+
+    def _put(self, filename, remote_name, timer):
+        return self._with_socket(self._put_on, filename, remote_name, timer)
+
+    def _get(self, filename, save_as, timer):
+        return self._with_socket(self._get_on, filename, save_as, timer)
+
+    def _query(self, command):
+        return self._with_socket(self._query_on, command)
+
+    def _query_on(self, sock, command):
+        # Queries are idempotent, so a lost command or reply is simply resent
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                sock.sendto(command, self.server_addr)
+                sock.settimeout(max(0.01, min(QUERY_RTO, deadline - time.monotonic())))
+                try:
+                    return self._expect(sock, 65536, skip=STALE_UDP_MESSAGES)
+                except TimeoutError:
+                    if time.monotonic() >= deadline:
+                        raise
+        finally:
+            sock.settimeout(self.timeout)
+
+    def _command(self, command, filename):
+        if self.fec_option is None:
+            return f"{command} {filename}".encode()
+        return f"{command} {filename} {fec.format_option(*self.fec_option)}".encode()
+
+    def _put_on(self, sock, filename, remote_name, timer):
+        if self.fec_option is not None:
+            return self._put_fec_on(sock, filename, remote_name, timer)
+
+        buf = self._buffer(UDP_CHUNK_SIZE)
+        timer.phase("handshake")
+        with open(filename, "rb") as f:
+            filesize = os.fstat(f.fileno()).st_size
+            sock.sendto(self._command("put", remote_name), self.server_addr)
+            self._expect(sock, 1024, b"Ack 0", skip=STALE_UDP_MESSAGES)
+            sock.sendto(f"LEN:{filesize}".encode(), self.server_addr)
+
+            timer.phase("data")
+            bytes_sent = 0
+            while bytes_sent < filesize:
+                n = f.readinto(buf)
+                timer.lap("disk_read")
+                if not n:
+                    raise TransferError("File shrank during upload")
+                sock.sendto(buf[:n], self.server_addr)
+                timer.lap("send")
+                window = flow.ack_window(self._expect(sock, 1024, skip=(b"WIN",)))
+                timer.lap("ack_wait")
+                bytes_sent += n
+
+                # Wait for the server's disk instead of overrunning its buffer
+                needed = min(UDP_CHUNK_SIZE, filesize - bytes_sent)
+                if window is not None and window < needed:
+                    flow.wait_for_window(lambda: self._expect(sock, 1024), window, needed)
+                    timer.lap("window_wait")
+
+        timer.phase("finish")
+        self._expect(sock, 1024, b"FIN")
+        sock.sendto(b"Ack 1", self.server_addr)
+        return bytes_sent, "File successfully uploaded."
+
+    def _get_on(self, sock, filename, save_as, timer):
+        if self.fec_option is not None:
+            return self._get_fec_on(sock, filename, save_as, timer)
+
+        timer.phase("handshake")
+        sock.sendto(self._command("get", filename), self.server_addr)
+        response = self._expect(sock, 4096, skip=STALE_UDP_MESSAGES)
+        if response == b"File not found":
+            raise TransferError(f"Server could not find file '{filename}'")
+        if response != b"Ack 0":
+            raise TransferError("Unexpected server response")
+
+        len_data = self._expect(sock, 1024)
+        if not len_data.startswith(b"LEN:"):
+            raise TransferError("Did not receive expected length info")
+        filesize = int(len_data[4:])
+        sock.sendto(b"ACK", self.server_addr)
+
+        timer.phase("data")
+        bytes_received = 0
+        update = None
+        with open(save_as, "wb") as f, flow.RingBuffer(timer.wrap_writes(f), self.recv_window) as ring:
+            while bytes_received < filesize:
+                data = flow.receive(sock, self.server_addr, UDP_CHUNK_SIZE + 100, update)
+                timer.lap("recv")
+                update = None
+                ring.write(data)
+                timer.lap("ring_write")
+                bytes_received += len(data)
+                free = ring.free()
+                sock.sendto(f"ACK {free}".encode(), self.server_addr)
+                timer.lap("ack_send")
+
+                needed = min(UDP_CHUNK_SIZE, filesize - bytes_received)
+                if needed and free < needed:
+                    update = flow.hold_window(sock, self.server_addr, ring, needed)
+                    timer.lap("window_hold")
+            timer.phase("flush")
+
+        timer.phase("finish")
+        self._expect(sock, 1024, b"FIN")
+        sock.sendto(b"Ack 1", self.server_addr)
+        return bytes_received, f"File downloaded and saved as {save_as}"
+
+    # In FEC mode every control message is repeated until the server answers,
+    # and the server's repeats are answered in turn (see common/fec.py).
+
+    def _put_fec_on(self, sock, filename, remote_name, timer):
+        k, r = self.fec_option
+        timer.phase("handshake")
+        with open(filename, "rb") as f:
+            filesize = os.fstat(f.fileno()).st_size
+            _check_busy(fec.request(sock, self.server_addr, self._command("put", remote_name),
+                                    (b"Ack 0", BUSY_MESSAGE)))
+            fec.request(sock, self.server_addr, f"LEN:{filesize}".encode(), (b"ACK",))
+            timer.phase("data")
+            trailer = fec.send_file(sock, self.server_addr, f, filesize, UDP_CHUNK_SIZE, k, r,
+                                    estimator=self.loss_estimator, timer=timer)
+        timer.phase("finish")
+        if trailer is None:
+            fec.expect(sock, self.server_addr, (b"FIN",))
+        sock.sendto(b"Ack 1", self.server_addr)
+        return filesize, "File successfully uploaded."
+
+    def _get_fec_on(self, sock, filename, save_as, timer):
+        timer.phase("handshake")
+        command = self._command("get", filename)
+        response = fec.request(sock, self.server_addr, command,
+                               (b"Ack 0", b"File not found", BUSY_MESSAGE))
+        _check_busy(response)
+        if response == b"File not found":
+            raise TransferError(f"Server could not find file '{filename}'")
+
+        len_data = fec.expect(sock, self.server_addr, (b"LEN:",), resend=[command], rto=1.0)
+        filesize = int(len_data[4:])
+        sock.sendto(b"ACK", self.server_addr)
+
+        timer.phase("data")
+        with open(save_as, "wb") as f, flow.RingBuffer(timer.wrap_writes(f), self.recv_window) as ring:
+            last_back = fec.receive_file(sock, self.server_addr, ring, filesize, UDP_CHUNK_SIZE,
+                                         idle_timeout=self.timeout, replies={b"LEN:": [b"ACK"]},
+                                         timer=timer)
+            timer.phase("flush")
+        timer.phase("finish")
+        fec.expect(sock, self.server_addr, (b"FIN",), resend=[last_back])
+        sock.sendto(b"Ack 1", self.server_addr)
+        return filesize, f"File downloaded and saved as {save_as}"
+
+
+class AsyncClient:
+    """
+    asyncio front end for a TCPClient or UDPClient.
+
+    Transfers run in worker threads (the protocols are blocking
+    stop-and-wait exchanges); at most `concurrency` run at once.
+    """
+
+    def __init__(self, client, concurrency=32):
+        self.client = client
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _call(self, fn, *args):
+        async with self._semaphore:
+            return await asyncio.to_thread(fn, *args)
+
+    async def put(self, filename, remote_name=None):
+        return await self._call(self.client.put, filename, remote_name)
+
+    async def get(self, filename, save_as=None):
+        return await self._call(self.client.get, filename, save_as)
+
+    async def stat(self, filename):
+        return await self._call(self.client.stat, filename)
+
+    async def list(self, prefix="", after=None, limit=None):
+        return await self._call(self.client.list, prefix, after, limit)
+
+    async def run(self, command, filename):
+        return await self._call(self.client.run, command, filename)
+
+    async def batch(self, commands):
+        """Same as the sync client's batch(), without blocking the event loop."""
+        return await asyncio.to_thread(self.client.batch, list(commands), self.concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.client.close()
+        return False
@@ -0,0 +1,430 @@
+"""
+Purpose: Forward error correction (FEC) mode for the UDP stop-and-wait protocol.
+
+In plain mode every 1000-byte chunk waits for its own ACK, so each lost
+datagram costs at least one more round trip. In FEC mode the sender sends a
+whole block of `k` data chunks plus `r` XOR parity chunks, and the receiver
+answers once per block:
+
+    data/parity packet:  0xFE | block (4 bytes) | index (1) | k (1) | r (1) | payload
+                         index < k is data chunk `index`; index >= k is parity
+                         group `index - k`, the XOR of data chunks i with
+                         i % r == index - k (padded to CHUNK_SIZE)
+    BACK <block> <lost> <seen> [<window>]
+                                 block complete; `lost` of the first `seen`
+                                 packets never arrived (used to adapt r), and
+                                 `window` bytes of receive buffer are free
+    NAK <block> <i,j,...>        data chunks that could not be rebuilt
+
+Any single loss per parity group is rebuilt by the receiver without a round
+trip. Anything else is repaired by NAK, or by resending the whole block if
+the sender hears nothing before its retransmission timeout. A block that does
+not fit in the receiver's window waits for a WIN update (common/flow.py), or,
+if the receiver's buffer is smaller than a block, for the largest window it
+has advertised.
+
+The mode is requested by adding an option to the command:
+    put <filename> fec                 (the client picks the block size/parity)
+    get <filename> fec[:<k>[:<r>]]     (k data chunks per block, r parity chunks;
+                                        without r, parity adapts to observed loss)
+The control messages around the data (Ack 0, LEN, FIN, Ack 1) are the same as
+in plain mode, except that the receiver of LEN answers it with ACK in both
+directions. Each side repeats its last control message until the next one
+arrives (see `request` and `expect`), so one lost control datagram no longer
+ends the transfer.
+"""
+
+import math
+import struct
+import time
+
+from common import flow, timing
+
+MAGIC = 0xFE
+HEADER = struct.Struct("!BIBBB")  # magic, block, index, k, r
+
+DEFAULT_BLOCK = 32
+MAX_BLOCK = 255
+
+
+def parse_option(token):
+    """
+    Parses a "fec[:<k>[:<r>]]" command option.
+    Returns (k, r) with r None for adaptive parity, or None if `token` is not
+    an FEC option.
+    """
+    parts = token.lower().split(":")
+    if parts[0] != "fec" or len(parts) > 3:
+        return None
+    k = int(parts[1]) if len(parts) > 1 and parts[1] else DEFAULT_BLOCK
+    r = int(parts[2]) if len(parts) > 2 else None
+    if not 1 <= k <= MAX_BLOCK or (r is not None and not 0 <= r <= k):
+        raise ValueError(f"Invalid FEC option '{token}'")
+    return k, r
+
+
+def format_option(k, r):
+    return f"fec:{k}" if r is None else f"fec:{k}:{r}"
+
+
+def is_fec_packet(data):
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+
+class LossEstimator:
+    """
+    Smoothed packet loss rate, used to pick how many parity chunks to send.
+
+    With interleaved XOR parity a block survives as long as no parity group
+    loses two packets, so the number of groups is kept at about twice the
+    expected number of losses per block.
+    """
+
+    def __init__(self, alpha=0.25, initial=0.02, min_parity=1):
+        self.alpha = alpha
+        self.rate = initial
+        self.min_parity = min_parity
+
+    def update(self, lost, seen):
+        if seen > 0:
+            self.rate += self.alpha * (lost / seen - self.rate)
+
+    def parity_for(self, k):
+        r = math.ceil(2 * self.rate * k)
+        return max(min(self.min_parity, k), min(r, k // 2 or 1))
+
+
+def _xor_into(acc, chunk):
+    """Returns acc XOR chunk, treating both as CHUNK_SIZE integers."""
+    return acc ^ int.from_bytes(chunk, "big")
+
+
+def encode_block(block_no, chunks, r, chunk_size):
+    """Returns the k data packets and r parity packets for one block."""
+    k = len(chunks)
+    packets = [HEADER.pack(MAGIC, block_no, i, k, r) + chunk for i, chunk in enumerate(chunks)]
+    for j in range(r):
+        acc = 0
+        for i in range(j, k, r):
+            acc = _xor_into(acc, chunks[i].ljust(chunk_size, b"\0"))
+        packets.append(HEADER.pack(MAGIC, block_no, k + j, k, r) + acc.to_bytes(chunk_size, "big"))
+    return packets
+
+
+class BlockDecoder:
+    """Collects the packets of one block and rebuilds lost data chunks."""
+
+    def __init__(self, block_no, k, lengths, chunk_size):
+        self.block_no = block_no
+        self.k = k
+        self.lengths = lengths    # expected length of each data chunk
+        self.chunk_size = chunk_size
+        self.data = {}
+        self.parity = {}          # (r, group) -> parity payload
+        self.seen = 0             # highest index received + 1
+        self.got = 0              # distinct packets received
+        self.first_report = None  # (lost, seen) when the block was first reported
+
+    def add(self, index, r, payload):
+        if index < self.k:
+            if index in self.data or len(payload) < self.lengths[index]:
+                return
+            self.data[index] = bytes(payload[:self.lengths[index]])
+        else:
+            key = (r, index - self.k)
+            if key in self.parity:
+                return
+            self.parity[key] = payload
+        self.got += 1
+        self.seen = max(self.seen, index + 1)
+
+    def report(self):
+        """(lost, seen) for the first round of this block."""
+        if self.first_report is None:
+            self.first_report = (self.seen - self.got, self.seen)
+        return self.first_report
+
+    def recover(self):
+        for (r, group), payload in self.parity.items():
+            members = range(group, self.k, r)
+            missing = [i for i in members if i not in self.data]
+            if len(missing) != 1:
+                continue
+            acc = int.from_bytes(payload, "big")
+            for i in members:
+                if i != missing[0]:
+                    acc = _xor_into(acc, self.data[i].ljust(self.chunk_size, b"\0"))
+            i = missing[0]
+            self.data[i] = acc.to_bytes(self.chunk_size, "big")[:self.lengths[i]]
+
+    def missing(self):
+        return [i for i in range(self.k) if i not in self.data]
+
+    def complete(self):
+        if len(self.data) < self.k and self.parity:
+            self.recover()
+        return len(self.data) == self.k
+
+    def chunks(self):
+        return [self.data[i] for i in range(self.k)]
+
+
+def _recv_from(sock, addr, bufsize):
+    while True:
+        data, sender = sock.recvfrom(bufsize)
+        if sender == addr:
+            return data
+
+
+def send_file(sock, addr, f, filesize, chunk_size, block_size=DEFAULT_BLOCK, parity=None,
+              estimator=None, acquire=None, max_retries=10, initial_rto=1.0, done=(b"FIN",),
+              timer=timing.NULL_TIMER):
+    """
+    Sends `filesize` bytes from file object `f` to `addr` in FEC blocks.
+
+    `parity` fixes r; if None, r follows `estimator` (a LossEstimator).
+    `acquire(nbytes)` is called before each packet is sent, for rate limiting.
+    A block is only sent once it fits in the window the last BACK advertised.
+    Each step of the block loop is recorded by `timer` (common/timing.py).
+    Returns the message starting with a `done` prefix (such as FIN) if one
+    arrived instead of the final block ACK, or None.
+    Raises TimeoutError if a block goes unacknowledged `max_retries` times.
+    """
+    estimator = estimator or LossEstimator()
+    srtt = None
+    rto = initial_rto
+    old_timeout = sock.gettimeout()
+    nblocks = math.ceil(filesize / (chunk_size * block_size))
+    bytes_left = filesize
+    window = None
+    max_window = 0  # Largest window the receiver has advertised
+
+    def send(packets):
+        for packet in packets:
+            if acquire:
+                acquire(len(packet))
+                timer.lap("pacing")
+            sock.sendto(packet, addr)
+            timer.lap("send")
+
+    try:
+        for block_no in range(nblocks):
+            chunks = []
+            while bytes_left > 0 and len(chunks) < block_size:
+                chunk = f.read(min(chunk_size, bytes_left))
+                if not chunk:
+                    raise ValueError("File shrank during transfer")
+                chunks.append(chunk)
+                bytes_left -= len(chunk)
+            timer.lap("disk_read")
+
+            block_bytes = sum(len(chunk) for chunk in chunks)
+            # A receive buffer smaller than one block never frees a whole block,
+            # so wait for no more room than the receiver has ever offered. The
+            # receiver then writes the block into its buffer as the disk drains.
+            needed = min(block_bytes, max_window)
+            if window is not None and window < needed:
+                # The receiver's disk is behind; wait for it instead of retransmitting
+                sock.settimeout(max(rto, 4 * flow.PERSIST_INTERVAL))
+                window = flow.wait_for_window(lambda: _recv_from(sock, addr, 1024),
+                                              window, needed)
+                max_window = max(max_window, window)
+                timer.lap("window_wait")
+
+            r = parity if parity is not None else estimator.parity_for(len(chunks))
+            r = min(r, len(chunks))
+            packets = encode_block(block_no, chunks, r, chunk_size)
+            timer.lap("encode")
+            sent_at = time.monotonic()
+            send(packets)
+            retries = 0
+
+            while True:
+                sock.settimeout(rto)
+                try:
+                    reply = _recv_from(sock, addr, 1024)
+                except TimeoutError:
+                    timer.lap("ack_wait")
+                    retries += 1
+                    if retries > max_retries:
+                        raise TimeoutError(f"Block {block_no} not acknowledged")
+                    rto = min(rto * 2, 10.0)
+                    send(packets)
+                    continue
+                timer.lap("ack_wait")
+
+                fields = reply.split()
+                if fields[:1] == [b"BACK"] and int(fields[1]) == block_no:
+                    if retries == 0:
+                        sample = time.monotonic() - sent_at
+                        srtt = sample if srtt is None else 0.875 * srtt + 0.125 * sample
+                        rto = max(0.05, 3 * srtt)
+                    estimator.update(int(fields[2]), int(fields[3]))
+                    window = int(fields[4]) if len(fields) > 4 else None
+                    max_window = max(max_window, window or 0)
+                    break
+                if fields[:1] == [b"NAK"] and int(fields[1]) == block_no and len(fields) > 2:
+                    send([packets[int(i)] for i in fields[2].split(b",")])
+                elif block_no == nblocks - 1 and reply.startswith(done):
+                    # The receiver moved on, so the last ACK was lost
+                    return reply
+    finally:
+        sock.settimeout(old_timeout)
+    return None
+
+
+def receive_file(sock, addr, out, filesize, chunk_size, acquire=None,
+                 gap_timeout=0.05, idle_timeout=15.0, replies=None, timer=timing.NULL_TIMER):
+    """
+    Receives `filesize` bytes of FEC blocks from `addr` and writes them to `out`.
+    If `out` is a flow.RingBuffer, each BACK advertises its free space, and
+    the next block is held off with WIN updates while the ring is too full.
+
+    A NAK is sent whenever the current block stalls for `gap_timeout` seconds.
+    `acquire(nbytes)` is called before each block is acknowledged.
+    `replies` maps prefixes of repeated control messages to the messages
+    that answer them (e.g. {b"LEN:": [b"ACK"]} if our LEN ACK was lost).
+    Returns the last BACK message, which the caller should resend if the
+    sender repeats the final block (see expect).
+    Raises TimeoutError if nothing arrives for `idle_timeout` seconds.
+    Each step of the packet loop is recorded by `timer` (common/timing.py).
+    """
+    old_timeout = sock.gettimeout()
+    sock.settimeout(gap_timeout)
+    written = 0
+    block_no = 0
+    decoder = None
+    last_back = None
+    last_heard = time.monotonic()
+    ring = out if isinstance(out, flow.RingBuffer) else None
+    update = None       # WIN message to repeat until the next block starts
+    update_sent = 0.0
+
+    try:
+        while written < filesize:
+            try:
+                data = _recv_from(sock, addr, HEADER.size + chunk_size)
+            except TimeoutError:
+                timer.lap("recv")
+                now = time.monotonic()
+                if now - last_heard > idle_timeout:
+                    raise TimeoutError("Sender went silent")
+                if update is not None and now - update_sent >= flow.PERSIST_INTERVAL:
+                    sock.sendto(update, addr)
+                    update_sent = now
+                if decoder is not None and decoder.got:
+                    decoder.report()
+                    missing = ",".join(str(i) for i in decoder.missing())
+                    sock.sendto(f"NAK {block_no} {missing}".encode(), addr)
+                    timer.lap("nak_send")
+                continue
+            timer.lap("recv")
+
+            if not is_fec_packet(data):
+                _answer(sock, addr, data, replies)
+                continue
+            _, b, index, k, r = HEADER.unpack_from(data)
+            # A header no sender produces (parity without r, an index past the
+            # block, k changing within a block) would break recovery; drop it
+            if not k or r > k or index >= k + r or (decoder is not None and k != decoder.k):
+                continue
+            last_heard = time.monotonic()
+            if b < block_no:
+                # Our ACK for an earlier block was lost
+                if last_back is not None:
+                    sock.sendto(last_back, addr)
+                if update is not None:
+                    sock.sendto(update, addr)
+                continue
+            if b > block_no:
+                continue
+            update = None
+
+            if decoder is None:
+                start = written
+                lengths = [max(0, min(chunk_size, filesize - start - i * chunk_size))
+                           for i in range(k)]
+                decoder = BlockDecoder(block_no, k, lengths, chunk_size)
+            decoder.add(index, r, memoryview(data)[HEADER.size:])
+            timer.lap("decode")
+
+            if decoder.complete():
+                for chunk in decoder.chunks():
+                    out.write(chunk)
+                    written += len(chunk)
+                timer.lap("ring_write" if ring is not None else "disk_write")
+                lost, seen = decoder.report()
+                if acquire:
+                    acquire(sum(decoder.lengths))
+                    timer.lap("pacing")
+                # The window promised in BACK decides whether a WIN must follow
+                free = ring.free() if ring is not None else None
+                window = f" {free}" if free is not None else ""
+                last_back = f"BACK {block_no} {lost} {seen}{window}".encode()
+                sock.sendto(last_back, addr)
+                timer.lap("ack_send")
+                block_no += 1
+                decoder = None
+
+                needed = min(k * chunk_size, filesize - written)
+                if free is not None and needed and free < needed:
+                    update = flow.hold_window(sock, addr, ring, needed)
+                    update_sent = last_heard = time.monotonic()
+                    timer.lap("window_hold")
+    finally:
+        sock.settimeout(old_timeout)
+    return last_back
+
+
+def _answer(sock, addr, data, replies):
+    """Sends the replies for a repeated control message, if it has any."""
+    for prefix, messages in (replies or {}).items():
+        if data.startswith(prefix):
+            for message in messages:
+                sock.sendto(message, addr)
+            return True
+    return False
+
+
+def expect(sock, addr, accept, replies=None, resend=(), rto=None, retries=10, bufsize=1024):
+    """
+    Waits for a control message from `addr` starting with one of the `accept`
+    prefixes and returns it.
+
+    Repeated control messages are answered from `replies` (see receive_file).
+    Repeated FEC packets, and with `rto` set each `rto` seconds of silence,
+    cause every message in `resend` to be sent again. Anything else is ignored.
+    Raises TimeoutError after `retries` silent periods.
+    """
+    resend = [m for m in resend if m is not None]
+    old_timeout = sock.gettimeout()
+    if rto is not None:
+        sock.settimeout(rto)
+    silent = 0
+    try:
+        while True:
+            try:
+                data = _recv_from(sock, addr, bufsize)
+            except TimeoutError:
+                silent += 1
+                if rto is None or silent > retries:
+                    raise
+                for message in resend:
+                    sock.sendto(message, addr)
+                continue
+
+            if data.startswith(accept):
+                return data
+            if is_fec_packet(data):
+                for message in resend:
+                    sock.sendto(message, addr)
+            else:
+                _answer(sock, addr, data, replies)
+    finally:
+        sock.settimeout(old_timeout)
+
+
+def request(sock, addr, message, accept, rto=1.0, retries=10):
+    """Sends control `message` until a reply starting with an `accept` prefix arrives."""
+    sock.sendto(message, addr)
+    return expect(sock, addr, accept, resend=[message], rto=rto, retries=retries)
@@ -0,0 +1,207 @@
+"""
+Purpose: Receiver-side flow control for the UDP transfers.
+
+The receiver of a file no longer writes each chunk to disk before
+acknowledging it. Chunks are copied into a bounded RingBuffer and ACKed at
+once, and a writer thread drains the ring to disk. Each acknowledgement
+advertises how much buffer space is left:
+
+    ACK <window>              plain mode, after every chunk
+    BACK <b> <lost> <seen> <window>
+                              FEC mode, after every block (common/fec.py)
+    WIN <window>              window update from the receiver
+
+The sender only sends the next chunk (or block) if it fits in the window.
+If it does not, the sender waits for a WIN update instead of retransmitting.
+While the window is closed, the receiver repeats WIN every PERSIST_INTERVAL
+so that the sender knows it is still alive. Once the disk has caught up, it
+repeats the WIN that reopens the window until the sender's next data arrives.
+
+A bare "ACK" advertises no window, and the sender is not limited.
+"""
+
+import threading
+
+DEFAULT_WINDOW = 1024 * 1024
+PERSIST_INTERVAL = 0.5
+
+
+class RingBuffer:
+    """
+    File-like object whose `write` copies into a fixed-size ring. A writer
+    thread drains the ring into `out` in the order the data was written.
+
+    `write` only blocks if the ring is full. An error raised by `out.write`
+    is raised again by the next `write` or `close`.
+    """
+
+    def __init__(self, out, capacity=DEFAULT_WINDOW):
+        self.out = out
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._head = 0     # index of the oldest byte not yet written to `out`
+        self._size = 0     # bytes waiting in the ring
+        self._closed = False
+        self._aborted = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def free(self):
+        with self._cond:
+            return self.capacity - self._size
+
+    def write(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), self.capacity):
+            self._put(view[start:start + self.capacity])
+        return len(view)
+
+    def _put(self, data):
+        n = len(data)
+        with self._cond:
+            while self.capacity - self._size < n and self._error is None and not self._aborted:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            if self._aborted:
+                raise ValueError("write to an aborted RingBuffer")
+            tail = (self._head + self._size) % self.capacity
+            first = min(n, self.capacity - tail)
+            self._buf[tail:tail + first] = data[:first]
+            self._buf[:n - first] = data[first:]
+            self._size += n
+            self._cond.notify_all()
+
+    def wait_free(self, nbytes, timeout=None):
+        """Waits until `nbytes` are free; returns False if `timeout` ran out first."""
+        nbytes = min(nbytes, self.capacity)
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: (self.capacity - self._size >= nbytes or self._error is not None
+                         or self._aborted),
+                timeout)
+
+    def _drain(self):
+        view = memoryview(self._buf)
+        while True:
+            with self._cond:
+                while self._size == 0 and not self._closed:
+                    self._cond.wait()
+                if self._size == 0 or self._aborted:
+                    return
+                # Only this thread moves the head, so the region stays put
+                head = self._head
+                n = min(self._size, self.capacity - head)
+            try:
+                self.out.write(view[head:head + n])
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                if self._aborted:
+                    return
+                self._head = (head + n) % self.capacity
+                self._size -= n
+                self._cond.notify_all()
+
+    def close(self):
+        """Waits until everything written has reached `out`."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        """Drops whatever has not been written yet and stops the writer thread."""
+        # The writer thread may be inside out.write; it sees the flag and stops
+        # rather than moving _head and _size past data that was dropped
+        with self._cond:
+            self._closed = True
+            self._aborted = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def ack_window(message):
+    """
+    Returns the window advertised by an ACK message, or None for a bare ACK.
+    Raises ValueError if `message` is not an ACK.
+    """
+    fields = message.split()
+    if not fields or fields[0] != b"ACK" or len(fields) > 2:
+        raise ValueError(f"Expected ACK, got {message[:40]!r}")
+    return int(fields[1]) if len(fields) == 2 else None
+
+
+def wait_for_window(recv, window, needed):
+    """
+    Sender side: reads messages with `recv()` until a WIN update opens the
+    window to at least `needed` bytes, and returns the new window. `recv`
+    should raise TimeoutError if the receiver goes silent.
+    """
+    while window < needed:
+        fields = recv().split()
+        if fields[:1] == [b"WIN"] and len(fields) == 2:
+            window = int(fields[1])
+    return window
+
+
+def hold_window(sock, addr, ring, needed):
+    """
+    Receiver side: waits until `needed` bytes of `ring` are free, sending
+    "WIN <free>" to `addr` every PERSIST_INTERVAL meanwhile. Returns the WIN
+    message that reopened the window, which has been sent and should be
+    repeated until the sender's next data arrives (see `receive`).
+    """
+    while not ring.wait_free(needed, PERSIST_INTERVAL):
+        sock.sendto(f"WIN {ring.free()}".encode(), addr)
+    update = f"WIN {ring.free()}".encode()
+    sock.sendto(update, addr)
+    return update
+
+
+def receive(sock, addr, bufsize, update=None):
+    """
+    Returns the next datagram from `addr`. If `update` is given, it is resent
+    after every PERSIST_INTERVAL of silence (the sender may not have seen it),
+    until the socket's own timeout has passed.
+    """
+    if update is None:
+        while True:
+            data, sender = sock.recvfrom(bufsize)
+            if sender == addr:
+                return data
+
+    old_timeout = sock.gettimeout()
+    sock.settimeout(PERSIST_INTERVAL)
+    waited = 0.0
+    try:
+        while True:
+            try:
+                data, sender = sock.recvfrom(bufsize)
+            except TimeoutError:
+                waited += PERSIST_INTERVAL
+                if old_timeout is not None and waited >= old_timeout:
+                    raise
+                sock.sendto(update, addr)
+                continue
+            if sender == addr:
+                return data
+    finally:
+        sock.settimeout(old_timeout)
@@ -0,0 +1,188 @@
+"""
+Purpose: In-memory index of stored files, behind the `list` and `stat` commands.
+
+Every storage backend (common/storage.py) keeps a FileIndex of the files in
+each namespace: name, size, mtime and SHA-256 digest. It is loaded when the
+backend opens, updated as each upload commits, and reloaded when another
+process (e.g. the other server, sharing the storage root) changes the
+files. Lookups and listings therefore cost no scan of the filesystem or the
+database, however many files a namespace holds.
+
+Each namespace keeps its names in a sorted list next to a dict of FileInfo.
+A prefix query bisects to the first match and walks forward, so one page
+costs O(log n + page size). Pages are resumed with a cursor, which is the
+last name of the previous page; a cursor stays valid while files are added.
+
+Wire format (both servers):
+
+    stat <filename>
+        -> "STAT <name> <size> <mtime> <digest>"  or  "File not found"
+    list [<prefix>] [limit=<n>] [after=<cursor>]
+        -> "LIST <count> <next cursor>" followed by <count> lines of
+           "<name> <size> <mtime> <digest>"
+
+mtime is whole seconds since the epoch. The digest is "-" when it is not
+known, e.g. for files the dir backend found on disk at startup. The next
+cursor is "-" on the last page.
+"""
+
+import bisect
+import threading
+from collections import namedtuple
+
+FileInfo = namedtuple("FileInfo", ["name", "size", "mtime", "digest"])
+Listing = namedtuple("Listing", ["entries", "next_after"])
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class FileIndex:
+    """
+    FileInfo records per namespace with sorted, paginated prefix queries.
+    All methods are safe to call from several threads.
+    """
+
+    def __init__(self, entries=()):
+        """`entries` is an iterable of (namespace, FileInfo), in any order."""
+        self._lock = threading.Lock()
+        self._spaces = {}  # namespace -> (sorted list of names, {name: FileInfo})
+        self.load(entries)
+
+    def load(self, entries):
+        """Replaces every record with `entries`, as given to the constructor."""
+        spaces = {}
+        for namespace, info in entries:
+            spaces.setdefault(namespace, ([], {}))[1][info.name] = info
+        for names, infos in spaces.values():
+            names.extend(sorted(infos))
+        with self._lock:
+            self._spaces = spaces
+
+    def load_namespace(self, namespace, infos):
+        """Replaces one namespace's records with the FileInfos in `infos`."""
+        by_name = {info.name: info for info in infos}
+        with self._lock:
+            self._spaces[namespace] = (sorted(by_name), by_name)
+
+    def put(self, namespace, info):
+        """Adds or replaces one file's record."""
+        with self._lock:
+            names, infos = self._spaces.setdefault(namespace, ([], {}))
+            if info.name not in infos:
+                bisect.insort(names, info.name)
+            infos[info.name] = info
+
+    def remove(self, namespace, name):
+        with self._lock:
+            names, infos = self._spaces.get(namespace, ([], {}))
+            if infos.pop(name, None) is not None:
+                del names[bisect.bisect_left(names, name)]
+
+    def get(self, namespace, name):
+        """Returns the FileInfo for `name`, or None if it is not stored."""
+        with self._lock:
+            return self._spaces.get(namespace, ([], {}))[1].get(name)
+
+    def count(self, namespace):
+        with self._lock:
+            return len(self._spaces.get(namespace, ([], {}))[0])
+
+    def query(self, namespace, prefix="", after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns a Listing of up to `limit` files whose names start with
+        `prefix` and sort after `after`, in name order. Its `next_after` is
+        the cursor for the following page, or None on the last one.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with self._lock:
+            names, infos = self._spaces.get(namespace, ([], {}))
+            start = bisect.bisect_left(names, prefix)
+            if after is not None:
+                start = max(start, bisect.bisect_right(names, after))
+            # One extra name tells whether another page follows
+            page = names[start:start + limit + 1]
+            entries = []
+            for name in page[:limit]:
+                if not name.startswith(prefix):
+                    break
+                entries.append(infos[name])
+        more = len(entries) == limit and len(page) > limit and page[limit].startswith(prefix)
+        return Listing(entries, entries[-1].name if more else None)
+
+
+def format_entry(info):
+    digest = info.digest or "-"
+    return f"{info.name} {info.size} {int(info.mtime)} {digest}"
+
+
+def parse_entry(line):
+    """Inverse of format_entry. Raises ValueError on a malformed line."""
+    name, size, mtime, digest = line.split(" ")
+    return FileInfo(name, int(size), int(mtime), None if digest == "-" else digest)
+
+
+def format_stat(info):
+    return f"STAT {format_entry(info)}".encode()
+
+
+def format_listing(listing, max_bytes=None):
+    """
+    Encodes a `list` reply. With `max_bytes`, entries are dropped from the end
+    until the reply fits, and the cursor is moved back to match.
+    """
+    header_room = 32 + max((len(e.name) for e in listing.entries), default=0)
+    lines = [format_entry(e) for e in listing.entries]
+    next_after = listing.next_after
+    if max_bytes is not None:
+        used = header_room
+        for i, line in enumerate(lines):
+            used += len(line.encode()) + 1
+            if used > max_bytes and i > 0:
+                lines = lines[:i]
+                next_after = listing.entries[i - 1].name
+                break
+    header = f"LIST {len(lines)} {next_after if next_after is not None else '-'}"
+    return "\n".join([header] + lines).encode()
+
+
+def parse_listing(data):
+    """Decodes a `list` reply into a Listing. Raises ValueError if malformed."""
+    lines = data.decode().split("\n")
+    fields = lines[0].split(" ")
+    if len(fields) != 3 or fields[0] != "LIST":
+        raise ValueError(f"Expected LIST, got {data[:40]!r}")
+    count = int(fields[1])
+    if len(lines) - 1 != count:
+        raise ValueError(f"LIST reply has {len(lines) - 1} entries, expected {count}")
+    entries = [parse_entry(line) for line in lines[1:]]
+    return Listing(entries, None if fields[2] == "-" else fields[2])
+
+
+def parse_list_options(tokens):
+    """
+    Returns (prefix, after, limit) for the arguments of a `list` command.
+    Raises ValueError on a malformed option.
+    """
+    prefix, after, limit = "", None, DEFAULT_PAGE_SIZE
+    for token in tokens:
+        if token.startswith("limit="):
+            limit = int(token[6:])
+        elif token.startswith("after="):
+            after = token[6:]
+        elif not prefix:
+            prefix = token
+        else:
+            raise ValueError(f"Unexpected list argument '{token}'")
+    return prefix, after, limit
+
+
+def format_list_command(prefix="", after=None, limit=None):
+    tokens = ["list"]
+    if prefix:
+        tokens.append(prefix)
+    if limit is not None:
+        tokens.append(f"limit={limit}")
+    if after is not None:
+        tokens.append(f"after={after}")
+    return " ".join(tokens).encode()
@@ -0,0 +1,179 @@
+"""
+Purpose: Resource limits shared by serverTCP.py and ServerUDP.py.
+
+Every command a server accepts is first admitted by a ResourceGovernor, which
+caps:
+
+    - the number of sessions in progress on the whole server,
+    - the number of sessions in progress per client IP, and
+    - the bytes one client IP may have buffered in server memory at once
+      (receive buffers, queued datagrams, upload ring buffers).
+
+A command over a limit is refused with "Server busy" straight away instead of
+being queued. Threads, descriptors and buffer memory therefore stay bounded
+however many clients connect.
+
+The servers also drop peers that go quiet (--idle-timeout, --read-timeout)
+and turn on TCP keepalive. That way a connection whose client vanished is
+noticed even while the server is only waiting to send.
+
+Sessions hold file descriptors (a TCP connection, the file being sent or
+stored), so the session cap must fit the process's descriptor limit. The
+servers raise the soft RLIMIT_NOFILE to the hard limit at startup, and by
+default cap sessions at what the raised limit leaves after FD_HEADROOM
+(default_max_sessions). If descriptors still run out, serverTCP.py backs off
+instead of failing in accept().
+"""
+
+import socket
+import threading
+
+try:
+    import resource
+except ImportError:  # Not on Windows; the limits there are not adjustable this way
+    resource = None
+
+BUSY_MESSAGE = b"Server busy"
+
+DEFAULT_MAX_SESSIONS = 1024
+DEFAULT_MAX_CLIENT_SESSIONS = 64
+DEFAULT_MAX_CLIENT_BYTES = 64 * 1024 * 1024
+
+# Descriptors kept back from sessions: listening socket, storage catalogue,
+# limits file, partial-upload scans, stdio
+FD_HEADROOM = 64
+# A TCP session holds its connection and the stored file
+FDS_PER_SESSION = 2
+# Upper bound when the hard limit is RLIM_INFINITY (setrlimit rejects it)
+MAX_FD_LIMIT = 1 << 20
+
+# Keepalive probes: first after `idle` seconds of silence, then every
+# KEEPALIVE_INTERVAL seconds; the connection is dropped after KEEPALIVE_COUNT
+# unanswered probes.
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+
+class LimitExceeded(Exception):
+    """Raised by ResourceGovernor.admit when a session would exceed a limit."""
+
+
+class Lease:
+    """
+    One admitted session's share of the server's and its client's limits:
+    a session slot plus `nbytes` of buffer space, held until `close()`.
+    """
+
+    def __init__(self, governor, client_ip, nbytes):
+        self.governor = governor
+        self.client_ip = client_ip
+        self.nbytes = nbytes
+        self.closed = False
+
+    def close(self):
+        self.governor._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ResourceGovernor:
+    """
+    Admission control for server sessions. None for a limit means unlimited.
+    """
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS,
+                 max_client_sessions=DEFAULT_MAX_CLIENT_SESSIONS,
+                 max_client_bytes=DEFAULT_MAX_CLIENT_BYTES):
+        self.max_sessions = max_sessions
+        self.max_client_sessions = max_client_sessions
+        self.max_client_bytes = max_client_bytes
+        self._lock = threading.Lock()
+        self._sessions = 0
+        self._clients = {}  # client IP -> [sessions, bytes reserved]
+
+    def admit(self, client_ip, nbytes=0):
+        """
+        Starts a session for `client_ip` holding `nbytes` of buffer space
+        (the most it will ever buffer). Returns its Lease, or raises
+        LimitExceeded.
+        """
+        with self._lock:
+            if self.max_sessions is not None and self._sessions >= self.max_sessions:
+                raise LimitExceeded(f"{self._sessions} sessions in progress")
+            sessions, reserved = self._clients.get(client_ip, (0, 0))
+            if self.max_client_sessions is not None and sessions >= self.max_client_sessions:
+                raise LimitExceeded(f"{client_ip} has {sessions} sessions in progress")
+            if self.max_client_bytes is not None and reserved + nbytes > self.max_client_bytes:
+                raise LimitExceeded(f"{client_ip} has {reserved} bytes buffered")
+            self._sessions += 1
+            self._clients[client_ip] = [sessions + 1, reserved + nbytes]
+            return Lease(self, client_ip, nbytes)
+
+    def active_sessions(self):
+        with self._lock:
+            return self._sessions
+
+    def client_usage(self, client_ip):
+        """(sessions, bytes reserved) for one client IP."""
+        with self._lock:
+            return tuple(self._clients.get(client_ip, (0, 0)))
+
+    def _close(self, lease):
+        with self._lock:
+            if lease.closed:
+                return
+            lease.closed = True
+            entry = self._clients[lease.client_ip]
+            entry[0] -= 1
+            entry[1] -= lease.nbytes
+            if entry[0] == 0:
+                del self._clients[lease.client_ip]
+            self._sessions -= 1
+
+
+def raise_fd_limit():
+    """
+    Raises the soft RLIMIT_NOFILE to the hard limit (at most MAX_FD_LIMIT) and
+    returns the soft limit in effect, or None where it is unknown.
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = MAX_FD_LIMIT if hard == resource.RLIM_INFINITY else min(hard, MAX_FD_LIMIT)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass  # Keep the current limit
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+def default_max_sessions(fds_per_session=FDS_PER_SESSION):
+    """
+    DEFAULT_MAX_SESSIONS, lowered to what the descriptor limit can serve
+    with FD_HEADROOM to spare. Call after raise_fd_limit().
+    """
+    if resource is None:
+        return DEFAULT_MAX_SESSIONS
+    soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_MAX_SESSIONS
+    return max(1, min(DEFAULT_MAX_SESSIONS, (soft - FD_HEADROOM) // fds_per_session))
+
+
+def enable_keepalive(sock, idle, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    """Turns on TCP keepalive for `sock`, with the timings where the platform allows."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # TCP_KEEPIDLE is called TCP_KEEPALIVE on macOS
+    idle_option = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+    for option, value in ((idle_option, idle),
+                          (getattr(socket, "TCP_KEEPINTVL", None), interval),
+                          (getattr(socket, "TCP_KEEPCNT", None), count)):
+        if option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, max(1, int(value)))
@@ -0,0 +1,348 @@
+"""
+Purpose: Per-client rate limiting and fair bandwidth scheduling for the servers.
+
+Every transfer the servers run is a scheduler session. Before a chunk is sent
+(or acknowledged, for uploads) the transfer calls `session.acquire(nbytes)`,
+which blocks until:
+
+    - the session's own token bucket allows it (per-session limit),
+    - the client IP's token bucket allows it (per-client limit), and
+    - it is this session's turn for the global egress bucket.
+
+Turns are handed out by weighted fair queuing: each request gets a virtual
+finish tag of max(virtual time, session's last tag) + nbytes / weight, and the
+eligible waiter with the smallest tag goes first. A short `get` therefore
+never waits behind a queue of chunks from a bulk transfer; bulk transfers
+share whatever bandwidth is left.
+
+Waiters sit in a heap ordered by tag. A grant pops the heap in order,
+setting aside waiters whose session or client is still in debt. It wakes
+only the waiter it granted, each through that waiter's own condition. One
+waiter at a time, the pacer, sleeps on a timer to hand out turns as the
+buckets refill; everyone else sleeps until granted.
+
+Rates are in bytes per second; None means unlimited. With no limits set,
+`acquire` returns immediately.
+
+A client's bucket outlives its sessions: after the last one closes it is
+kept until it has refilled, so a client that reconnects for every command
+still pays off the debt of its previous transfers.
+
+Limits can be changed at runtime with `set_limits()` / `set_client_rate()`,
+or by editing the JSON file given to `watch_limits_file()`:
+
+    {"global_rate": 50000000, "client_rate": 10000000, "session_rate": null,
+     "clients": {"10.0.0.5": 1000000}}
+"""
+
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket that may go into debt.
+
+    A request is allowed whenever the bucket is not in debt, and then takes
+    all the tokens it needs. This lets chunks larger than the burst size
+    through while keeping the long-run rate at `rate`.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = None
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0)
+        self.tokens = min(self.tokens, self.burst) if rate else 0.0
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now):
+        """Seconds until the bucket can admit a request (0 if it can now)."""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def consume(self, nbytes):
+        if self.rate:
+            self.tokens -= nbytes
+
+    def full(self, now):
+        """True if the bucket is as good as new (it holds no debt to remember)."""
+        self._refill(now)
+        return not self.rate or self.tokens >= self.burst
+
+
+class _Waiter:
+    __slots__ = ("session", "nbytes", "start", "finish", "granted", "cond")
+
+    def __init__(self, session, nbytes, start, finish):
+        self.session = session
+        self.nbytes = nbytes
+        self.start = start
+        self.finish = finish
+        self.granted = False
+        self.cond = None  # created on first wait; shares the scheduler's lock
+
+
+class Session:
+    """One transfer registered with a BandwidthScheduler."""
+
+    def __init__(self, scheduler, client_ip, weight):
+        self.scheduler = scheduler
+        self.client_ip = client_ip
+        self.weight = weight
+        self.bucket = TokenBucket(scheduler.session_rate)
+        self.last_finish = 0.0
+
+    def acquire(self, nbytes):
+        """Blocks until this session may move `nbytes` more bytes."""
+        self.scheduler.acquire(self, nbytes)
+
+    def close(self):
+        self.scheduler.unregister(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class BandwidthScheduler:
+    """
+    Token-bucket limits per client and per session, weighted fair queuing
+    across active sessions, and a global egress cap.
+    """
+
+    # Upper bound on how long a waiter sleeps before re-checking its turn
+    MAX_WAIT = 0.05
+    # Idle client buckets are checked for expiry this often (seconds) and
+    # at most this many are kept, oldest dropped first
+    SWEEP_INTERVAL = 1.0
+    MAX_IDLE_CLIENTS = 65536
+
+    def __init__(self, global_rate=None, client_rate=None, session_rate=None):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate)
+        self._clients = {}        # client IP -> [TokenBucket, active session count]
+        self._client_rates = {}   # per-client overrides of client_rate
+        self._idle_clients = {}   # client IPs with no session, oldest first
+        self._last_sweep = time.monotonic()
+        self._sessions = set()
+        self._waiting = []        # heap of (finish tag, seq, _Waiter)
+        self._pacer = None        # the waiter that sleeps on a timer
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.session_rate = session_rate
+
+    # ---------------------------- sessions ----------------------------
+
+    def session(self, client_ip, weight=1.0):
+        """Registers a new transfer for `client_ip` and returns its Session."""
+        with self._lock:
+            session = Session(self, client_ip, weight)
+            self._sweep_idle_clients()
+            entry = self._clients.get(client_ip)
+            if entry is None:
+                entry = [TokenBucket(self._client_rates.get(client_ip, self.client_rate)), 0]
+                self._clients[client_ip] = entry
+            self._idle_clients.pop(client_ip, None)
+            entry[1] += 1
+            session.last_finish = self._virtual_time
+            self._sessions.add(session)
+            return session
+
+    def unregister(self, session):
+        with self._lock:
+            if session not in self._sessions:
+                return
+            self._sessions.discard(session)
+            entry = self._clients[session.client_ip]
+            entry[1] -= 1
+            if entry[1] == 0:
+                # Keep the bucket (and any debt) until it has refilled
+                self._idle_clients[session.client_ip] = None
+                if len(self._idle_clients) > self.MAX_IDLE_CLIENTS:
+                    oldest = next(iter(self._idle_clients))
+                    del self._idle_clients[oldest]
+                    del self._clients[oldest]
+            self._reschedule()
+
+    def _sweep_idle_clients(self):
+        """Forgets idle clients whose buckets have refilled. Caller holds the lock."""
+        now = time.monotonic()
+        if now - self._last_sweep < self.SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for ip in [ip for ip in self._idle_clients if self._clients[ip][0].full(now)]:
+            del self._idle_clients[ip]
+            del self._clients[ip]
+
+    def active_sessions(self):
+        with self._lock:
+            return len(self._sessions)
+
+    # ----------------------------- limits -----------------------------
+
+    def unlimited(self):
+        return not (self.global_rate or self.client_rate or self.session_rate
+                    or self._client_rates)
+
+    def set_limits(self, global_rate=None, client_rate=None, session_rate=None):
+        """Replaces the global, default per-client and per-session rates."""
+        with self._lock:
+            self.global_rate = global_rate
+            self.client_rate = client_rate
+            self.session_rate = session_rate
+            self._global.set_rate(global_rate)
+            for ip, entry in self._clients.items():
+                entry[0].set_rate(self._client_rates.get(ip, client_rate))
+            for session in self._sessions:
+                session.bucket.set_rate(session_rate)
+            self._reschedule()
+
+    def set_client_rates(self, rates):
+        """Replaces all per-client overrides with the {client IP: rate} mapping."""
+        with self._lock:
+            self._client_rates = dict(rates)
+            for ip, entry in self._clients.items():
+                entry[0].set_rate(self._client_rates.get(ip, self.client_rate))
+            self._reschedule()
+
+    def set_client_rate(self, client_ip, rate):
+        """Overrides the rate for one client IP (None restores the default)."""
+        with self._lock:
+            if rate is None:
+                self._client_rates.pop(client_ip, None)
+            else:
+                self._client_rates[client_ip] = rate
+            entry = self._clients.get(client_ip)
+            if entry is not None:
+                entry[0].set_rate(self._client_rates.get(client_ip, self.client_rate))
+            self._reschedule()
+
+    # ---------------------------- admission ---------------------------
+
+    def acquire(self, session, nbytes):
+        if self.unlimited():
+            return
+
+        with self._lock:
+            start = max(self._virtual_time, session.last_finish)
+            waiter = _Waiter(session, nbytes, start, start + nbytes / session.weight)
+            session.last_finish = waiter.finish
+            heapq.heappush(self._waiting, (waiter.finish, next(self._seq), waiter))
+            wait = self._dispatch(time.monotonic())
+
+            while not waiter.granted:
+                if waiter.cond is None:
+                    waiter.cond = threading.Condition(self._lock)
+                if self._pacer is None:
+                    self._pacer = waiter
+                waiter.cond.wait(wait if self._pacer is waiter else None)
+                if self._pacer is waiter and not waiter.granted:
+                    wait = self._dispatch(time.monotonic())
+
+            if self._pacer is waiter:
+                # Hand the timer to the next waiter in line
+                self._pacer = self._waiting[0][2] if self._waiting else None
+                if self._pacer is not None:
+                    self._pacer.cond.notify()
+
+    def _local_delay(self, session, now):
+        client_bucket = self._clients[session.client_ip][0]
+        return max(session.bucket.delay(now), client_bucket.delay(now))
+
+    def _dispatch(self, now):
+        """
+        Grants turns in tag order to waiters whose session and client buckets
+        are not in debt, while the global bucket allows. Returns the seconds
+        until it is worth trying again. Caller holds the lock.
+        """
+        wait = self.MAX_WAIT
+        in_debt = []
+        try:
+            while self._waiting:
+                global_delay = self._global.delay(now)
+                if global_delay > 0:
+                    wait = min(wait, global_delay)
+                    break
+                item = heapq.heappop(self._waiting)
+                local = self._local_delay(item[2].session, now)
+                if local > 0:
+                    in_debt.append(item)
+                    wait = min(wait, local)
+                    continue
+                self._grant(item[2])
+        finally:
+            for item in in_debt:
+                heapq.heappush(self._waiting, item)
+        return wait
+
+    def _grant(self, waiter):
+        self._virtual_time = max(self._virtual_time, waiter.start)
+        waiter.session.bucket.consume(waiter.nbytes)
+        self._clients[waiter.session.client_ip][0].consume(waiter.nbytes)
+        self._global.consume(waiter.nbytes)
+        waiter.granted = True
+        if waiter.cond is not None:
+            waiter.cond.notify()
+
+    def _reschedule(self):
+        """After a limit or session change: grant what can go now, and have
+        the pacer recompute its timer. Caller holds the lock."""
+        self._dispatch(time.monotonic())
+        if self._pacer is not None and not self._pacer.granted:
+            self._pacer.cond.notify()
+
+
+def load_limits(scheduler, path):
+    """Applies the limits in JSON file `path` to `scheduler`."""
+    with open(path) as f:
+        limits = json.load(f)
+    scheduler.set_limits(limits.get("global_rate"),
+                         limits.get("client_rate"),
+                         limits.get("session_rate"))
+    scheduler.set_client_rates(limits.get("clients", {}))
+
+
+def watch_limits_file(scheduler, path, interval=1.0):
+    """
+    Loads `path` now and reloads it whenever its modification time changes.
+    Runs in a daemon thread; errors in the file are reported and ignored.
+    """
+    def reload_if_changed(last_mtime):
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime != last_mtime:
+                load_limits(scheduler, path)
+                print(f"[*] Loaded rate limits from {path}")
+            return mtime
+        except (OSError, ValueError) as e:
+            print(f"[-] Could not load rate limits from {path}: {e}")
+            return last_mtime
+
+    def watch(last_mtime):
+        while True:
+            time.sleep(interval)
+            last_mtime = reload_if_changed(last_mtime)
+
+    mtime = reload_if_changed(None)
+    threading.Thread(target=watch, args=(mtime,), daemon=True).start()
@@ -0,0 +1,254 @@
+"""
+Purpose: Encrypted transports for the TCP and UDP file transfer programs.
+
+TCP uses TLS from the standard library `ssl` module. The server's context
+issues TLS 1.3 session tickets; TCPClient keeps the latest session and
+offers it on the next connection, so repeated commands (each one is a new
+connection) resume instead of running a full handshake.
+
+UDP uses an authenticated-encryption framing layer keyed from a pre-shared
+key (PSK) file. Every datagram becomes:
+
+    0xA5 | key id (8 bytes) | nonce (12 bytes) | ChaCha20-Poly1305 ciphertext + tag (16)
+
+Each client socket picks a random key id, and both sides derive the session
+key as HKDF-SHA256(PSK, salt=key id). The derived key is cached and reused
+for every transfer over that socket (UDPClient pools its sockets). The
+server caches keys by key id, so the per-datagram cost is one AEAD call
+plus 37 bytes. Datagrams that fail authentication are dropped silently.
+
+The nonce is a 4-byte sender prefix and an 8-byte big-endian counter. A
+client sends with prefix 0 and counts from 0; its key id is never shared,
+so its nonces never repeat. A server sends to all its clients from one
+counter, under a random prefix with the top bit set, starting from the
+clock in microseconds so that a restarted server continues above its old
+counters. Each side accepts only the other side's prefix.
+
+Replay protection: the receiver keeps, per key id, the highest counter it
+has authenticated and a bitmap of the REPLAY_WINDOW counters below it, as
+in IPsec and WireGuard. A datagram whose counter was already seen, or is
+too old for the window, is dropped. On the server a key id is also bound
+to the address that opened it; the same key id from another address is
+dropped. A key id enters the server's cache only once a datagram under it
+has authenticated, so forged datagrams cannot push real clients out. When
+the server forgets a key id (more than MAX_KEYS in use), it takes it back
+only at a counter below REPLAY_WINDOW, i.e. from a new socket, so the
+forgotten window cannot be replayed into.
+
+The UDP layer needs the `cryptography` package (pip install cryptography);
+TLS needs nothing beyond the standard library.
+
+Create a PSK file with:
+    python -c "import os; print(os.urandom(32).hex())" > udp.key
+"""
+
+import collections
+import hashlib
+import hmac
+import os
+import ssl
+import struct
+import threading
+import time
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+except ImportError:  # Only needed for encrypted UDP
+    ChaCha20Poly1305 = None
+    InvalidTag = None
+
+MAGIC = 0xA5
+KEY_ID_SIZE = 8
+NONCE_SIZE = 12
+TAG_SIZE = 16
+HEADER_SIZE = 1 + KEY_ID_SIZE
+OVERHEAD = HEADER_SIZE + NONCE_SIZE + TAG_SIZE
+NONCE = struct.Struct(">IQ")  # sender prefix, counter
+SERVER_PREFIX_BIT = 0x80000000
+REPLAY_WINDOW = 1024  # counters remembered below the highest one seen
+
+
+# ================================ TLS (TCP) ================================
+
+def server_tls_context(certfile, keyfile):
+    """TLS context for serverTCP.py. One context is shared by all connections
+    so that session tickets it issues can be resumed."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def client_tls_context(cafile=None, verify=True):
+    """
+    TLS context for TCPClient. `cafile` trusts a specific (e.g. self-signed)
+    certificate; verify=False skips certificate checks entirely.
+    """
+    context = ssl.create_default_context(cafile=cafile)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+# ============================ AEAD framing (UDP) ============================
+
+def load_psk(path):
+    """Reads a pre-shared key file holding at least 32 bytes of hex."""
+    with open(path) as f:
+        key = bytes.fromhex(f.read().strip())
+    if len(key) < 32:
+        raise ValueError(f"{path}: pre-shared key must be at least 32 bytes")
+    return key
+
+
+def derive_key(psk, key_id):
+    """HKDF-SHA256 (RFC 5869) with the key id as salt; one 32-byte output block."""
+    prk = hmac.new(key_id, psk, hashlib.sha256).digest()
+    return hmac.new(prk, b"ICSI416 UDP v1\x01", hashlib.sha256).digest()
+
+
+class _KeySession:
+    """Cipher, replay window and (server side) bound address of one key id."""
+
+    __slots__ = ("cipher", "addr", "highest", "seen")
+
+    def __init__(self, cipher):
+        self.cipher = cipher
+        self.addr = None
+        self.highest = -1  # Highest authenticated counter
+        self.seen = 0      # Bit i set: counter highest - i was received
+
+    def is_fresh(self, counter):
+        """True if `counter` was not seen before and is not too old to tell."""
+        if counter > self.highest:
+            return True
+        offset = self.highest - counter
+        return offset < REPLAY_WINDOW and not (self.seen >> offset) & 1
+
+    def mark(self, counter):
+        """Records `counter`. Call only after the datagram authenticated."""
+        if counter > self.highest:
+            shift = counter - self.highest
+            self.seen = ((self.seen << shift) | 1) & ((1 << REPLAY_WINDOW) - 1) \
+                if shift < REPLAY_WINDOW else 1
+            self.highest = counter
+        else:
+            self.seen |= 1 << (self.highest - counter)
+
+
+class SecureDatagramSocket:
+    """
+    Wraps a UDP socket so that sendto/recvfrom carry encrypted, authenticated
+    datagrams. It has the same methods as a UDP socket, so it can be used
+    wherever the plain socket was.
+
+    Client side: every datagram is sent under this socket's own random key
+    id. Server side (server=True): keys are derived on demand for each key id
+    seen, and replies to an address use that address's key id. Replayed
+    datagrams are dropped on both sides (see the module docstring).
+    """
+
+    MAX_KEYS = 4096
+    MAX_PEERS = 65536
+
+    def __init__(self, sock, psk, server=False):
+        if ChaCha20Poly1305 is None:
+            raise RuntimeError("Encrypted UDP needs the 'cryptography' package "
+                               "(pip install cryptography)")
+        self.sock = sock
+        self.psk = psk
+        self.server = server
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()  # key id -> _KeySession
+        self._peer_keys = collections.OrderedDict()  # address -> key id (server side)
+        self._recv_buf = bytearray(65536 + OVERHEAD)
+        self.key_id = None
+        if server:
+            self._prefix = SERVER_PREFIX_BIT | int.from_bytes(os.urandom(4), "big")
+            self._counter = time.time_ns() // 1000
+        else:
+            self._prefix = 0
+            self._counter = 0
+            self.key_id = os.urandom(KEY_ID_SIZE)
+            self._sessions[self.key_id] = _KeySession(
+                ChaCha20Poly1305(derive_key(psk, self.key_id)))
+
+    def sendto(self, data, addr):
+        key_id = self._peer_keys.get(addr) if self.server else self.key_id
+        if key_id is None:
+            return 0  # No authenticated datagram from this peer yet
+        header = bytes([MAGIC]) + key_id
+        with self._lock:
+            counter = self._counter
+            self._counter += 1
+            session = self._sessions.get(key_id)
+        nonce = NONCE.pack(self._prefix, counter)
+        # A forgotten session is not recreated here; recvfrom decides whether to take it back
+        cipher = session.cipher if session else ChaCha20Poly1305(derive_key(self.psk, key_id))
+        ciphertext = cipher.encrypt(nonce, data, header)
+        # Scatter-gather send avoids joining header and ciphertext into a new buffer
+        self.sock.sendmsg([header, nonce, ciphertext], [], 0, addr)
+        return len(data)
+
+    def recvfrom(self, bufsize):
+        view = memoryview(self._recv_buf)
+        while True:
+            n, addr = self.sock.recvfrom_into(self._recv_buf, bufsize + OVERHEAD)
+            if n < OVERHEAD or self._recv_buf[0] != MAGIC:
+                continue
+            key_id = bytes(view[1:HEADER_SIZE])
+            if not self.server and key_id != self.key_id:
+                continue
+            prefix, counter = NONCE.unpack_from(self._recv_buf, HEADER_SIZE)
+            # Only the other side's datagrams; this drops our own reflected back
+            if bool(prefix & SERVER_PREFIX_BIT) == self.server:
+                continue
+            # Nothing is cached or reordered until the datagram authenticates,
+            # so forged key ids cannot push real sessions out of the cache
+            with self._lock:
+                session = self._sessions.get(key_id)
+            if session is None:
+                # A forgotten key id is only taken back from a new socket
+                if counter >= REPLAY_WINDOW:
+                    continue
+                cipher = ChaCha20Poly1305(derive_key(self.psk, key_id))
+            elif not session.is_fresh(counter) or (
+                    self.server and session.addr is not None and session.addr != addr):
+                continue
+            else:
+                cipher = session.cipher
+            nonce = view[HEADER_SIZE:HEADER_SIZE + NONCE_SIZE]
+            try:
+                data = cipher.decrypt(
+                    nonce, view[HEADER_SIZE + NONCE_SIZE:n], view[:HEADER_SIZE])
+            except InvalidTag:
+                continue
+            with self._lock:
+                session = self._sessions.get(key_id)
+                if session is None:
+                    session = self._sessions[key_id] = _KeySession(cipher)
+                    if len(self._sessions) > self.MAX_KEYS:
+                        self._sessions.popitem(last=False)
+                elif not session.is_fresh(counter):
+                    continue  # Received meanwhile by another thread
+                else:
+                    self._sessions.move_to_end(key_id)
+                session.mark(counter)
+                if self.server:
+                    session.addr = addr
+                    self._peer_keys[addr] = key_id
+                    self._peer_keys.move_to_end(addr)
+                    if len(self._peer_keys) > self.MAX_PEERS:
+                        self._peer_keys.popitem(last=False)
+            return data, addr
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        data, addr = self.recvfrom(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data), addr
+
+    def __getattr__(self, name):
+        # settimeout, gettimeout, setblocking, bind, close, fileno, ...
+        return getattr(self.sock, name)
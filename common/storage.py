@@ -0,0 +1,396 @@
+"""
+Purpose: Storage backends shared by serverTCP.py and ServerUDP.py.
+
+Both servers store uploads in a per-client namespace (the client's IP address)
+and look files up again on `get`. The backend decides where the bytes live:
+
+    cas  - Content-addressed blob store (default). Each distinct file body is
+           stored once under blobs/<sha256[:2]>/<sha256>, and an sqlite index
+           maps (namespace, filename) to the blob. Uploading a file that is
+           already stored only adds an index row.
+    dir  - One plain directory per client: <root>/<ip_with_underscores>/<filename>.
+
+Usage:
+    store = open_storage("cas", "uploads")
+
+    with store.writer(client_ip, filename) as f:   # commits on success,
+        f.write(data)                              # discards on exception
+
+    f = store.open(client_ip, filename)            # None if not stored
+    store.list(client_ip, prefix="log-", limit=100)  # from the in-memory index
+
+Every backend keeps a FileIndex (common/index.py) of its files, so `stat`,
+`list` and the lookup in `open` never scan the disk. Both servers may share
+one storage root, so the disk (or the sqlite catalogue) stays the source of
+truth and the index is checked against it cheaply before it is used:
+
+    cas  - sqlite's `PRAGMA data_version` changes whenever another connection
+           commits. The index is reloaded from the catalogue when it has.
+           Uploads update the catalogue in one write transaction that also
+           places the new blob and deletes the one it replaced, so processes
+           never delete a blob another one still refers to.
+    dir  - `stat` checks the file with os.stat. `list` rescans a namespace
+           when its directory's mtime has changed since the last scan.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common.index import DEFAULT_PAGE_SIZE, FileIndex, FileInfo
+
+# Temporary upload files untouched for this long belong to no live transfer
+STALE_UPLOAD_AGE = 3600
+
+
+class UploadWriter:
+    """
+    File-like object that receives an upload into a temporary file.
+
+    The data is hashed as it is written. Nothing is visible to `open`/`stat`
+    until `commit()` is called; `discard()` removes the temporary file.
+    """
+
+    def __init__(self, tmp_dir, on_commit):
+        fd, self.tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self._on_commit = on_commit
+        self._done = False
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self):
+        """Finishes the upload and hands the temporary file to the backend."""
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        try:
+            self._on_commit(self.tmp_path, self.size, self._hash.hexdigest())
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def discard(self):
+        """Drops a partial upload."""
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+
+class StorageBackend:
+    """
+    Interface implemented by every storage backend.
+
+    Namespaces are client IP addresses; filenames are the names sent with
+    `put`/`get`. All methods are safe to call from several threads.
+    """
+
+    def writer(self, namespace, filename):
+        """Returns an UploadWriter that stores `filename` when committed."""
+        raise NotImplementedError
+
+    def open(self, namespace, filename):
+        """Returns a binary file object for reading, or None if not stored."""
+        # A second lookup covers a file replaced by another process in between
+        for _ in range(2):
+            info = self.stat(namespace, filename)
+            if info is None:
+                return None
+            try:
+                return open(self._data_path(namespace, filename, info), "rb")
+            except FileNotFoundError:
+                pass
+        return None
+
+    def stat(self, namespace, filename):
+        """Returns a FileInfo for a stored file, or None if not stored."""
+        self._refresh(namespace)
+        return self.index.get(self._index_key(namespace), filename)
+
+    def list(self, namespace, prefix="", after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns a Listing of the namespace's files whose names start with
+        `prefix`, one page at a time (see FileIndex.query).
+        """
+        self._refresh(namespace)
+        return self.index.query(self._index_key(namespace), prefix, after, limit)
+
+    def close(self):
+        pass
+
+    def remove_partial_uploads(self, older_than=STALE_UPLOAD_AGE):
+        """
+        Deletes temporary upload files not modified for `older_than` seconds,
+        such as those left behind by a server that was killed mid-upload.
+        Returns how many were removed.
+        """
+        removed = 0
+        cutoff = time.time() - older_than
+        with os.scandir(self.tmp_dir) as entries:
+            for entry in entries:
+                if not entry.name.startswith(".upload-"):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # Committed or discarded meanwhile
+        return removed
+
+    def _data_path(self, namespace, filename, info):
+        raise NotImplementedError
+
+    def _index_key(self, namespace):
+        return namespace
+
+    def _refresh(self, namespace):
+        """Brings the namespace's index records up to date with the storage root."""
+        raise NotImplementedError
+
+    def _scan(self):
+        """Yields (index key, FileInfo) for every stored file."""
+        raise NotImplementedError
+
+
+class ContentAddressedStore(StorageBackend):
+    """
+    Stores each distinct file body once, keyed by its SHA-256 digest.
+
+    Layout under `root`:
+        blobs/ab/abcdef...   file bodies
+        tmp/                 uploads in progress
+        index.sqlite3        (namespace, name) -> digest, size, mtime
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"),
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " namespace TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " PRIMARY KEY (namespace, name))")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS files_digest ON files (digest)")
+        self.index = FileIndex()
+        self._data_version = None
+        self._refresh(None)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def writer(self, namespace, filename):
+        def on_commit(tmp_path, size, digest):
+            with self._lock:
+                # The write lock is database-wide, so it also keeps other
+                # processes from releasing a blob this upload is about to use
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    path = self.blob_path(digest)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.replace(tmp_path, path)
+                    row = self._db.execute(
+                        "SELECT digest FROM files WHERE namespace = ? AND name = ?",
+                        (namespace, filename)).fetchone()
+                    mtime = time.time()
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                        (namespace, filename, digest, size, mtime))
+                    if row is not None and row[0] != digest:
+                        self._release(row[0])
+                    self._db.commit()
+                except BaseException:
+                    self._db.rollback()
+                    raise
+                self.index.put(namespace, FileInfo(filename, size, mtime, digest))
+
+        return UploadWriter(self.tmp_dir, on_commit)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _data_path(self, namespace, filename, info):
+        return self.blob_path(info.digest)
+
+    def _refresh(self, namespace):
+        # data_version changes only when another connection commits; our own
+        # commits are already in the index
+        with self._lock:
+            version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self.index.load(self._scan())
+                self._data_version = version
+
+    def _scan(self):
+        # The sqlite table is the catalogue; the blobs carry no names
+        rows = self._db.execute("SELECT namespace, name, size, mtime, digest FROM files")
+        for namespace, name, size, mtime, digest in rows:
+            yield namespace, FileInfo(name, size, mtime, digest)
+
+    def _release(self, digest):
+        """
+        Deletes a blob once no catalogue row refers to it. Caller holds the
+        lock and the database's write transaction.
+        """
+        in_use = self._db.execute(
+            "SELECT 1 FROM files WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        if in_use is None:
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+
+class DirectoryStore(StorageBackend):
+    """
+    Stores files as-is in one directory per client:
+        <root>/<ip_with_underscores>/<filename>
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, ".tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._dir_mtimes = {}  # index key -> namespace dir mtime when last scanned
+        self.index = FileIndex(self._scan())
+
+    def namespace_dir(self, namespace):
+        return os.path.join(self.root, namespace.replace('.', '_').replace(':', '_'))
+
+    def path(self, namespace, filename):
+        # Only the final path component is used so clients cannot escape their directory
+        return os.path.join(self.namespace_dir(namespace), os.path.basename(filename))
+
+    def writer(self, namespace, filename):
+        def on_commit(tmp_path, size, digest):
+            path = self.path(namespace, filename)
+            # The file on disk and its index record must change together, or
+            # two uploads of one name could leave `get` and `stat` disagreeing
+            with self._lock:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                self.index.put(self._index_key(namespace), FileInfo(
+                    os.path.basename(path), size, os.stat(path).st_mtime, digest))
+
+        return UploadWriter(self.tmp_dir, on_commit)
+
+    def stat(self, namespace, filename):
+        # One os.stat keeps the record right if another process replaced or
+        # added the file; the digest is kept only while the file is unchanged
+        path = self.path(namespace, filename)
+        key = self._index_key(namespace)
+        name = os.path.basename(path)
+        with self._lock:
+            info = self.index.get(key, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                if info is not None:
+                    self.index.remove(key, name)
+                return None
+            if info is None or (info.size, info.mtime) != (st.st_size, st.st_mtime):
+                info = FileInfo(name, st.st_size, st.st_mtime, None)
+                self.index.put(key, info)
+            return info
+
+    def _data_path(self, namespace, filename, info):
+        return self.path(namespace, filename)
+
+    def _index_key(self, namespace):
+        return os.path.basename(self.namespace_dir(namespace))
+
+    def _refresh(self, namespace):
+        key = self._index_key(namespace)
+        with self._lock:
+            try:
+                mtime = os.stat(self.namespace_dir(namespace)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime == self._dir_mtimes.get(key):
+                return
+            infos = list(self._scan_namespace(self.namespace_dir(namespace)))
+            # Digests are kept for files that are unchanged since they were recorded
+            for i, found in enumerate(infos):
+                known = self.index.get(key, found.name)
+                if known is not None and (known.size, known.mtime) == (found.size, found.mtime):
+                    infos[i] = known
+            self.index.load_namespace(key, infos)
+            # A change within the same clock tick as the scan would leave the
+            # mtime as it is, so a directory changed just now is rescanned again
+            if mtime is not None and time.time_ns() - mtime > 2 * 10**9:
+                self._dir_mtimes[key] = mtime
+            else:
+                self._dir_mtimes.pop(key, None)
+
+    def _scan(self):
+        # Digests of files found on disk are not known until they are uploaded again
+        with os.scandir(self.root) as dirs:
+            for ns_entry in dirs:
+                if ns_entry.name == ".tmp" or not ns_entry.is_dir():
+                    continue
+                for info in self._scan_namespace(ns_entry.path):
+                    yield ns_entry.name, info
+
+    def _scan_namespace(self, path):
+        try:
+            with os.scandir(path) as files:
+                for entry in files:
+                    if entry.is_file():
+                        st = entry.stat()
+                        yield FileInfo(entry.name, st.st_size, st.st_mtime, None)
+        except FileNotFoundError:
+            return
+
+
+BACKENDS = {
+    "cas": ContentAddressedStore,
+    "dir": DirectoryStore,
+}
+
+
+def open_storage(kind, root):
+    """
+    Creates the storage backend named `kind` ("cas" or "dir") rooted at `root`.
+    """
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{kind}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[kind](root)
@@ -0,0 +1,332 @@
+"""
+Purpose: Per-transfer timing and profiling for the servers and the client library.
+
+A TransferTimer splits one transfer into phases (handshake, data, flush,
+commit, finish) and, inside the data phase, records how long each step of
+the per-chunk loop took, into one Histogram per step:
+
+    timer.phase("data")
+    while ...:
+        chunk = f.read(n);         timer.lap("disk_read")
+        transfer.acquire(n);       timer.lap("pacing")
+        sock.sendto(chunk, addr);  timer.lap("send")
+        reply = recv();            timer.lap("ack_wait")
+
+`lap(name)` charges the time since the previous lap (or phase start) to
+`name`, so the laps of a phase add up to the phase's duration. Python
+overhead between two steps shows up in the lap that follows it. Disk
+writes done by a RingBuffer's writer thread run alongside the loop; they
+are recorded separately as "disk_write" by wrapping the file with
+`timer.wrap_writes(f)`. Steps recorded this way overlap the laps, so
+reports list them apart ("in parallel") rather than among the laps' shares.
+
+Instrumentation is the server-wide (or client-wide) switch. When it is off,
+`start()` returns NULL_TIMER, whose methods do nothing. The cost of
+instrumenting a transfer loop is then one empty method call per step.
+When it is on, each finished transfer is merged into running totals
+(`report()`), and optionally:
+
+    timings=True        a one-line breakdown is printed per transfer
+    profile_dir=<dir>   the transfer runs under cProfile, and a report
+                        (<name>.txt, plus <name>.prof for pstats/snakeviz)
+                        is written per transfer. Only one transfer at a time
+                        is profiled; transfers starting meanwhile are only
+                        timed.
+"""
+
+import cProfile
+import io
+import math
+import os
+import pstats
+import re
+import threading
+import time
+from math import frexp
+
+clock = time.perf_counter
+
+# Histogram resolution: buckets per power of two (about 19% wide each)
+SUB_BUCKETS = 4
+PROFILE_LINES = 30
+
+_profile_lock = threading.Lock()
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.3f}s"
+
+
+class Histogram:
+    """
+    Log-scale histogram of durations in seconds. Percentiles are accurate to
+    one bucket; `max` and `total` are exact.
+    """
+
+    def __init__(self):
+        self.buckets = {}  # bucket number -> count
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def record(self, seconds):
+        # Kept to a handful of operations: it runs several times per chunk
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        mantissa, exponent = frexp(seconds or 1e-9)
+        bucket = exponent * SUB_BUCKETS + int(mantissa * 2 * SUB_BUCKETS)
+        buckets = self.buckets
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0 < p <= 100)."""
+        count = self.count
+        if not count:
+            return 0.0
+        rank = math.ceil(count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # mantissa * 2 * SUB_BUCKETS runs from SUB_BUCKETS to 2 * SUB_BUCKETS - 1
+                exponent, sub = divmod(bucket, SUB_BUCKETS)
+                upper = (sub + SUB_BUCKETS + 1) / (2 * SUB_BUCKETS) * 2.0 ** (exponent - 1)
+                return min(upper, self.max)
+        return self.max
+
+    def format(self):
+        count = self.count
+        mean = self.total / count if count else 0.0
+        return (f"n={count:<8} total={format_seconds(self.total):>9} "
+                f"mean={format_seconds(mean):>8} p50={format_seconds(self.percentile(50)):>8} "
+                f"p99={format_seconds(self.percentile(99)):>8} "
+                f"p99.9={format_seconds(self.percentile(99.9)):>8} "
+                f"max={format_seconds(self.max):>8}")
+
+
+class _TimedWrites:
+    """File proxy whose `write` calls are recorded in `timer`'s "disk_write" histogram."""
+
+    def __init__(self, f, timer):
+        self._f = f
+        self._timer = timer
+
+    def write(self, data):
+        start = clock()
+        n = self._f.write(data)
+        self._timer.record("disk_write", clock() - start)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class TransferTimer:
+    """Phases and per-step histograms of one transfer. See the module docstring."""
+
+    enabled = True
+
+    def __init__(self, label, profile=False):
+        self.label = label
+        self.phases = []        # [name, seconds] in the order they ran
+        self.histograms = {}    # step name -> Histogram
+        self.parallel = set()   # steps from record(), which overlap the laps
+        self.elapsed = None
+        self.profiler = None
+        if profile and _profile_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) owns the hook
+                self.profiler = None
+                _profile_lock.release()
+        self.started = self._last = clock()
+        self._phase = None
+
+    def phase(self, name):
+        """Ends the current phase, if any, and starts `name`."""
+        now = clock()
+        if self._phase is not None:
+            self._phase[1] = now - self._phase_start
+        self._phase = [name, 0.0]
+        self.phases.append(self._phase)
+        self._phase_start = self._last = now
+
+    def lap(self, name):
+        """Charges the time since the previous lap or phase start to `name`."""
+        now = clock()
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(now - self._last)
+        self._last = now
+
+    def record(self, name, seconds):
+        """Adds one measurement to `name` without moving the lap clock."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+            self.parallel.add(name)
+        histogram.record(seconds)
+
+    def wrap_writes(self, f):
+        return _TimedWrites(f, self)
+
+    def stop(self):
+        if self.elapsed is not None:
+            return
+        now = clock()
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profile_lock.release()
+        if self._phase is not None:
+            self._phase[1] = now - self._phase_start
+        self.elapsed = now - self.started
+
+    def summary(self):
+        """
+        One line: the phases, then each data-loop step's share of its phase.
+        Steps that ran in parallel with the loop follow separately, since
+        their shares do not add up with the laps'.
+        """
+        phases = " + ".join(f"{name} {format_seconds(seconds)}" for name, seconds in self.phases)
+        line = f"{self.label}: {format_seconds(self.elapsed or 0.0)} = {phases or '-'}"
+        data = sum(seconds for name, seconds in self.phases if name == "data")
+        if data > 0:
+            laps, parallel = _split_steps(self.histograms, self.parallel)
+            if laps:
+                line += " | data: " + ", ".join(f"{name} {h.total / data:.0%}" for name, h in laps)
+            if parallel:
+                line += " | in parallel: " + ", ".join(
+                    f"{name} {h.total / data:.0%}" for name, h in parallel)
+        return line
+
+    def report(self):
+        lines = [self.summary(), "", "Phases:"]
+        lines += [f"    {name:<12} {format_seconds(seconds):>10}" for name, seconds in self.phases]
+        lines += _format_steps(self.histograms, self.parallel)
+        return "\n".join(lines)
+
+
+class NullTimer:
+    """Stands in for a TransferTimer when instrumentation is off."""
+
+    enabled = False
+    label = None
+    profiler = None
+
+    def phase(self, name):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def record(self, name, seconds):
+        pass
+
+    def wrap_writes(self, f):
+        return f
+
+    def stop(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def _split_steps(histograms, parallel):
+    """(laps, parallel steps), each a list of (name, Histogram), largest total first."""
+    steps = sorted(histograms.items(), key=lambda item: -item[1].total)
+    return ([item for item in steps if item[0] not in parallel],
+            [item for item in steps if item[0] in parallel])
+
+
+def _format_steps(histograms, parallel):
+    laps, parallel = _split_steps(histograms, parallel)
+    lines = ["", "Steps:"] + [f"    {name:<12} {h.format()}" for name, h in laps]
+    if parallel:
+        lines += ["In parallel with the steps:"]
+        lines += [f"    {name:<12} {h.format()}" for name, h in parallel]
+    return lines
+
+
+class Instrumentation:
+    """
+    Hands out a timer per transfer and keeps running totals across them.
+    Off (the default) unless `timings` or `profile_dir` is given.
+    """
+
+    def __init__(self, timings=False, profile_dir=None, log=print):
+        self.timings = timings
+        self.profile_dir = profile_dir
+        self.log = log
+        self.enabled = bool(timings or profile_dir)
+        self.transfers = 0
+        self.phases = {}       # phase name -> Histogram of phase durations
+        self.histograms = {}   # step name -> Histogram, merged over transfers
+        self.parallel = set()  # steps that ran alongside the laps (TransferTimer.parallel)
+        self._lock = threading.Lock()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self, label):
+        """Returns the timer for a new transfer. Call from the thread that runs it."""
+        if not self.enabled:
+            return NULL_TIMER
+        return TransferTimer(label, profile=bool(self.profile_dir))
+
+    def finish(self, timer):
+        """Stops `timer`, adds it to the totals and prints or writes its report."""
+        if not timer.enabled:
+            return
+        timer.stop()
+        with self._lock:
+            self.transfers += 1
+            number = self.transfers
+            for name, seconds in timer.phases:
+                self.phases.setdefault(name, Histogram()).record(seconds)
+            for name, histogram in timer.histograms.items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+            self.parallel |= timer.parallel
+        if self.timings:
+            self.log(f"[*] {timer.summary()}")
+        if timer.profiler is not None:
+            self._write_profile(timer, number)
+
+    def report(self):
+        """Totals over every finished transfer."""
+        with self._lock:
+            lines = [f"Timings over {self.transfers} transfers", "Phases:"]
+            lines += [f"    {name:<12} {h.format()}" for name, h in self.phases.items()]
+            lines += _format_steps(self.histograms, self.parallel)
+        return "\n".join(lines)
+
+    def _write_profile(self, timer, number):
+        name = re.sub(r"[^\w.-]+", "_", f"{number:06d}-{timer.label}")[:120]
+        path = os.path.join(self.profile_dir, name)
+        stream = io.StringIO()
+        stats = pstats.Stats(timer.profiler, stream=stream)
+        stream.write(timer.report() + "\n\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+        stats.sort_stats("tottime").print_stats(PROFILE_LINES)
+        try:
+            with open(path + ".txt", "w") as f:
+                f.write(stream.getvalue())
+            timer.profiler.dump_stats(path + ".prof")
+        except OSError as e:
+            self.log(f"[-] Could not write profile {path}: {e}")
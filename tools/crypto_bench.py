@@ -0,0 +1,218 @@
+"""
+Purpose: Measures what the encrypted transports cost.
+
+Two measurements:
+    1. AEAD framing (encrypted UDP): seconds of CPU per GB to seal and open
+       datagrams of the UDP chunk size, done in memory with no network.
+    2. TLS vs plain TCP: loopback throughput of serverTCP.py-style transfers,
+       with and without TLS, and the handshake cost with and without session
+       resumption.
+
+If no certificate is given, a throwaway self-signed one is generated with the
+`openssl` command line tool.
+
+Usage:
+    python tools/crypto_bench.py [--size-mb N] [--chunk BYTES] [--cert PEM --key PEM]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import secure
+from common.client import UDP_CHUNK_SIZE
+
+
+class _LoopbackSocket:
+    """Stands in for a UDP socket: keeps the last datagram sent and returns it."""
+
+    def __init__(self):
+        self.datagram = b""
+
+    def sendmsg(self, buffers, ancdata, flags, addr):
+        self.datagram = b"".join(buffers)
+        return len(self.datagram)
+
+    def recvfrom_into(self, buffer, nbytes):
+        n = len(self.datagram)
+        buffer[:n] = self.datagram
+        return n, ("127.0.0.1", 0)
+
+
+def bench_aead(total, chunk):
+    """
+    Seals and opens `total` bytes as `chunk`-sized datagrams.
+    Returns (seconds sealing, seconds opening, bytes processed).
+    """
+    psk = os.urandom(32)
+    link = _LoopbackSocket()
+    sender = secure.SecureDatagramSocket(link, psk)
+    receiver = secure.SecureDatagramSocket(link, psk, server=True)
+    payload = os.urandom(chunk)
+    count = max(1, total // chunk)
+    addr = ("127.0.0.1", 0)
+
+    seal = 0.0
+    unseal = 0.0
+    for _ in range(count):
+        t0 = time.perf_counter()
+        sender.sendto(payload, addr)
+        t1 = time.perf_counter()
+        receiver.recvfrom(chunk)
+        seal += t1 - t0
+        unseal += time.perf_counter() - t1
+    return seal, unseal, count * chunk
+
+
+def make_certificate(directory):
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        raise RuntimeError("openssl not found; pass --cert and --key")
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run([openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                    "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def _serve(listener, context, total, stop):
+    """Sends `total` bytes to every connection, then closes it."""
+    data = bytes(64 * 1024)
+    while not stop.is_set():
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        try:
+            if context is not None:
+                conn = context.wrap_socket(conn, server_side=True)
+            remaining = total
+            while remaining > 0:
+                n = min(remaining, len(data))
+                conn.sendall(data[:n])
+                remaining -= n
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+
+def _fetch(port, context, session=None):
+    """
+    Connects and reads until the server closes. Returns (bytes, handshake
+    seconds, total seconds, TLS session, whether the session was resumed).
+    """
+    start = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", port))
+    if context is not None:
+        sock = context.wrap_socket(sock, server_hostname="localhost", session=session)
+    handshake = time.perf_counter() - start
+    buf = bytearray(64 * 1024)
+    received = 0
+    while True:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        received += n
+    elapsed = time.perf_counter() - start
+    session = getattr(sock, "session", None)
+    reused = bool(getattr(sock, "session_reused", False))
+    sock.close()
+    return received, handshake, elapsed, session, reused
+
+
+def _listen(context, total):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    stop = threading.Event()
+    threading.Thread(target=_serve, args=(listener, context, total, stop),
+                     daemon=True).start()
+    return listener, stop
+
+
+def bench_throughput(total, server_context=None, client_context=None):
+    """Bytes per second for one `total`-byte transfer over loopback."""
+    listener, stop = _listen(server_context, total)
+    try:
+        received, _, elapsed, _, _ = _fetch(listener.getsockname()[1], client_context)
+    finally:
+        stop.set()
+        listener.close()
+    return received / elapsed
+
+
+def bench_handshakes(server_context, client_context, rounds=50):
+    """Median seconds for full and resumed TLS handshakes, and how many resumed."""
+    listener, stop = _listen(server_context, 1)
+    port = listener.getsockname()[1]
+    full, resumed = [], []
+    reused_count = 0
+    try:
+        session = _fetch(port, client_context)[3]
+        for _ in range(rounds):
+            full.append(_fetch(port, client_context)[1])
+            _, handshake, _, new_session, reused = _fetch(port, client_context, session)
+            resumed.append(handshake)
+            reused_count += reused
+            # TLS 1.3 tickets are single use, so keep the newest one
+            session = new_session
+    finally:
+        stop.set()
+        listener.close()
+    return sorted(full)[rounds // 2], sorted(resumed)[rounds // 2], reused_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encryption overhead benchmark")
+    parser.add_argument("--size-mb", type=int, default=256,
+                        help="bytes moved per measurement (MB, default 256)")
+    parser.add_argument("--chunk", type=int, default=UDP_CHUNK_SIZE,
+                        help=f"UDP datagram payload size (default {UDP_CHUNK_SIZE})")
+    parser.add_argument("--cert")
+    parser.add_argument("--key")
+    args = parser.parse_args()
+    total = args.size_mb * 1000 * 1000
+
+    print(f"[*] AEAD (ChaCha20-Poly1305) on {args.chunk}-byte datagrams, {args.size_mb} MB")
+    try:
+        seal, unseal, nbytes = bench_aead(total, args.chunk)
+    except RuntimeError as e:
+        print(f"[-] {e}")
+    else:
+        gb = nbytes / 1e9
+        print(f"[+] seal: {seal / gb:.2f} s/GB   open: {unseal / gb:.2f} s/GB   "
+              f"wire overhead: {secure.OVERHEAD / args.chunk:.1%}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.cert and args.key:
+            cert, key = args.cert, args.key
+        else:
+            cert, key = make_certificate(tmp)
+        server_context = secure.server_tls_context(cert, key)
+        client_context = secure.client_tls_context(cert)
+
+        print(f"[*] TCP loopback, {args.size_mb} MB per transfer")
+        plain = bench_throughput(total)
+        tls = bench_throughput(total, server_context, client_context)
+        print(f"[+] plain: {plain / 1e6:.1f} MB/s   TLS: {tls / 1e6:.1f} MB/s   "
+              f"({1 - tls / plain:.1%} slower)")
+
+        rounds = 50
+        full, resumed, reused = bench_handshakes(server_context, client_context, rounds)
+        print(f"[+] handshake: full {full * 1000:.2f} ms   resumed {resumed * 1000:.2f} ms   "
+              f"({reused} of {rounds} resumed)")
+
+
+if __name__ == "__main__":
+    main()
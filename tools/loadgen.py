@@ -0,0 +1,365 @@
+"""
+Purpose: Load generator for the TCP and UDP file servers.
+
+Simulates many clients at once, each sending from its own loopback address
+(127.1.0.1, 127.1.0.2, ...), so the server sees them as distinct client IPs
+with their own storage namespaces and per-client limits. The clients replay a
+mix of put/get operations with file sizes drawn from a distribution, and the
+tool reports throughput, error rate and p50/p99/p999 latency per operation.
+
+The work is spread over several processes. Each runs an asyncio event loop
+that schedules its share of the clients and runs the transfers through
+common.client.AsyncClient.
+
+Arrivals:
+    closed loop (default)  every client runs one operation after another,
+                           pausing --think seconds in between
+    open loop (--rate R)   operations arrive as a Poisson process at R per
+                           second, whether or not earlier ones finished.
+                           Latency is measured from the scheduled arrival, so
+                           queueing behind a saturated server is included.
+                           Several comma-separated rates run as successive
+                           steps, which makes the saturation point easy to spot.
+
+Before measuring, every client uploads one file (not counted) so that `get`
+has something to fetch. Afterwards a `get` picks one of the files the client
+has uploaded; a client whose prefill failed does a `put` instead.
+
+Usage:
+    python tools/loadgen.py <tcp|udp> <ServerPort> [ServerIP] [options]
+
+    python tools/loadgen.py udp 12345 --clients 2000 --duration 30
+    python tools/loadgen.py tcp 12345 --clients 1000 --rate 200,400,800,1600 \\
+        --mix put=1,get=4 --sizes lognormal:20k:1.5
+
+Options:
+    --clients N          simulated clients (default 100)
+    --processes N        worker processes (default: CPU count)
+    --duration S         seconds per step (default 10)
+    --rate R[,R...]      open loop at R operations/s (default: closed loop)
+    --think S            closed loop pause between operations (default 0)
+    --mix OP=W,...       relative weights of put and get (default put=1,get=1)
+    --sizes DIST         put file sizes: fixed:N, uniform:A:B, exp:MEAN or
+                         lognormal:MEDIAN:SIGMA; sizes take k/m suffixes
+                         (default lognormal:32k:1)
+    --files N            distinct local files drawn from --sizes (default 64)
+    --max-inflight N     open loop: operations in progress at once, beyond
+                         which arrivals are counted as client overload
+                         (default 2000)
+    --base-address IP    first source address (default 127.1.0.1)
+    --timeout S          per-operation socket timeout
+    --fec [k[:r]]        UDP forward error correction mode
+    --json               print each step's report as one JSON object
+
+On Linux every 127.0.0.0/8 address is routed to loopback, so no setup is
+needed. Other systems need the source addresses configured first.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import fec, limits
+from common.client import AsyncClient, TCPClient, UDPClient
+
+Record = namedtuple("Record", ["op", "ok", "nbytes", "latency", "message"])
+
+# Remote names each client cycles through, so server storage stays bounded
+NAMES_PER_CLIENT = 4
+# Uploads in flight at once per process while prefilling, and tries per client
+PREFILL_CONCURRENCY = 64
+PREFILL_TRIES = 3
+
+
+def parse_size(text):
+    """'32k' -> 32768; accepts k/m/g suffixes."""
+    text = text.strip().lower()
+    scale = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}.get(text[-1:], 1)
+    if scale != 1:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+
+def parse_sizes(spec):
+    """Returns a function rng -> file size for a --sizes distribution."""
+    kind, _, rest = spec.partition(":")
+    params = [parse_size(p) if kind != "lognormal" or i == 0 else float(p)
+              for i, p in enumerate(rest.split(":")) if p]
+    if kind == "fixed" and len(params) == 1:
+        return lambda rng: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda rng: rng.randint(params[0], params[1])
+    if kind == "exp" and len(params) == 1:
+        return lambda rng: int(rng.expovariate(1 / params[0]))
+    if kind == "lognormal" and len(params) == 2:
+        mu = math.log(params[0])
+        return lambda rng: int(rng.lognormvariate(mu, params[1]))
+    raise ValueError(f"Invalid size distribution '{spec}'")
+
+
+def parse_mix(spec):
+    """'put=1,get=4' -> (("put", "get"), (1.0, 4.0))."""
+    ops, weights = [], []
+    for item in spec.split(","):
+        op, _, weight = item.partition("=")
+        if op not in ("put", "get"):
+            raise ValueError(f"Unknown operation '{op}' in --mix")
+        ops.append(op)
+        weights.append(float(weight or 1))
+    return tuple(ops), tuple(weights)
+
+
+def client_address(base, index):
+    return str(ipaddress.IPv4Address(base) + index)
+
+
+def make_files(directory, count, sample, rng):
+    """Creates `count` files with sizes drawn by `sample`; returns their paths."""
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"load-{i}.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(max(0, sample(rng))))
+        paths.append(path)
+    return paths
+
+
+def make_client(args, index):
+    options = {"bind_address": client_address(args.base_address, index)}
+    if args.timeout is not None:
+        options["timeout"] = args.timeout
+    if args.protocol == "tcp":
+        return TCPClient(args.host, args.port, **options)
+    return UDPClient(args.host, args.port, fec_option=args.fec_option, **options)
+
+
+class SimulatedClient:
+    """One client: its own source address and the files it has stored."""
+
+    def __init__(self, args, index, rng, files, concurrency):
+        self.index = index
+        self.rng = rng
+        self.files = files
+        self.client = AsyncClient(make_client(args, index), concurrency)
+        self.stored = set()
+        self.next_name = 0
+
+    async def prefill(self, semaphore):
+        for attempt in range(PREFILL_TRIES):
+            async with semaphore:
+                result = await self.client.put(self.rng.choice(self.files), "lg-0.bin")
+            if result.ok:
+                self.stored.add("lg-0.bin")
+                return True
+            await asyncio.sleep(0.1 * (attempt + 1))
+        return False
+
+    async def run(self, op):
+        """Runs `op`; returns (operation actually run, TransferResult)."""
+        if op == "get" and self.stored:
+            return op, await self.client.get(self.rng.choice(sorted(self.stored)), os.devnull)
+        name = f"lg-{self.next_name % NAMES_PER_CLIENT}.bin"
+        self.next_name += 1
+        result = await self.client.put(self.rng.choice(self.files), name)
+        if result.ok:
+            self.stored.add(name)
+        return "put", result
+
+    def close(self):
+        self.client.client.close()
+
+
+async def _closed_loop(clients, ops, weights, deadline, think, records):
+    async def loop(client):
+        while time.monotonic() < deadline:
+            op, result = await client.run(client.rng.choices(ops, weights)[0])
+            records.append(Record(op, result.ok, result.nbytes, result.elapsed, result.message))
+            if think:
+                await asyncio.sleep(client.rng.expovariate(1 / think))
+
+    await asyncio.gather(*(loop(c) for c in clients))
+
+
+async def _open_loop(clients, ops, weights, deadline, rate, max_inflight, rng, records):
+    inflight = 0
+    tasks = set()
+
+    async def arrival(client, op, scheduled):
+        nonlocal inflight
+        try:
+            op, result = await client.run(op)
+            latency = time.monotonic() - scheduled
+            records.append(Record(op, result.ok, result.nbytes, latency, result.message))
+        finally:
+            inflight -= 1
+
+    next_at = time.monotonic()
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at >= deadline:
+            break
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        op = rng.choices(ops, weights)[0]
+        if inflight >= max_inflight:
+            records.append(Record(op, False, 0, 0.0, "client overload: too many in flight"))
+            continue
+        inflight += 1
+        task = asyncio.create_task(arrival(rng.choice(clients), op, next_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def run_worker(args, indexes, files, rate, seed):
+    """
+    Runs one process's share of the clients for one step.
+    Returns (Records, number of clients whose prefill failed).
+    """
+    # Every simulated transfer holds a socket; allow as many as the system does
+    limits.raise_fd_limit()
+    rng = random.Random(seed)
+    ops, weights = args.mix
+    max_inflight = max(1, args.max_inflight // args.processes)
+    threads = max_inflight if rate else len(indexes)
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(threads))
+        clients = [SimulatedClient(args, i, random.Random(seed + i), files, threads)
+                   for i in indexes]
+        try:
+            semaphore = asyncio.Semaphore(PREFILL_CONCURRENCY)
+            prefilled = await asyncio.gather(*(c.prefill(semaphore) for c in clients))
+            records = []
+            deadline = time.monotonic() + args.duration
+            if rate:
+                await _open_loop(clients, ops, weights, deadline, rate, max_inflight, rng,
+                                 records)
+            else:
+                await _closed_loop(clients, ops, weights, deadline, args.think, records)
+            return records, prefilled.count(False)
+        finally:
+            for c in clients:
+                c.close()
+
+    return asyncio.run(main())
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(records, elapsed):
+    """Per-operation (and overall) statistics for one step."""
+    summary = {}
+    for op in sorted({r.op for r in records}) + ["all"]:
+        selected = [r for r in records if op == "all" or r.op == op]
+        ok = [r for r in selected if r.ok]
+        latencies = sorted(r.latency for r in ok)
+        errors = Counter(r.message for r in selected if not r.ok)
+        summary[op] = {
+            "count": len(selected),
+            "errors": len(selected) - len(ok),
+            "error_rate": (len(selected) - len(ok)) / len(selected) if selected else 0.0,
+            "ops_per_s": len(ok) / elapsed,
+            "mb_per_s": sum(r.nbytes for r in ok) / elapsed / 1e6,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "p999_ms": percentile(latencies, 99.9) * 1000,
+            "top_errors": errors.most_common(3),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'op':<5} {'count':>7} {'errors':>7} {'err%':>6} {'ops/s':>8} {'MB/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8}")
+    for op, s in summary.items():
+        print(f"{op:<5} {s['count']:>7} {s['errors']:>7} {s['error_rate'] * 100:>6.2f} "
+              f"{s['ops_per_s']:>8.1f} {s['mb_per_s']:>8.2f} {s['p50_ms']:>8.1f} "
+              f"{s['p99_ms']:>8.1f} {s['p999_ms']:>8.1f}")
+    for message, count in summary["all"]["top_errors"]:
+        print(f"[-] {count} x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the file servers")
+    parser.add_argument("protocol", choices=["tcp", "udp"])
+    parser.add_argument("port", type=int)
+    parser.add_argument("host", nargs="?", default="127.0.0.1")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", help="open loop operations/s; comma-separated for steps")
+    parser.add_argument("--think", type=float, default=0.0)
+    parser.add_argument("--mix", default="put=1,get=1")
+    parser.add_argument("--sizes", default="lognormal:32k:1")
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--max-inflight", type=int, default=2000)
+    parser.add_argument("--base-address", default="127.1.0.1")
+    parser.add_argument("--timeout", type=float)
+    parser.add_argument("--fec", nargs="?", const="", metavar="K[:R]")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        args.mix = parse_mix(args.mix)
+        sample = parse_sizes(args.sizes)
+        rates = [float(r) for r in args.rate.split(",")] if args.rate else [None]
+        args.fec_option = None
+        if args.fec is not None:
+            if args.protocol != "udp":
+                raise ValueError("--fec is only available with udp")
+            args.fec_option = fec.parse_option(f"fec:{args.fec}" if args.fec else "fec")
+    except ValueError as e:
+        parser.error(str(e))
+    args.processes = max(1, min(args.processes, args.clients))
+
+    rng = random.Random(args.seed)
+    shares = [list(range(p, args.clients, args.processes)) for p in range(args.processes)]
+
+    with tempfile.TemporaryDirectory(prefix="loadgen-") as directory:
+        files = make_files(directory, args.files, sample, rng)
+        sizes = sorted(os.path.getsize(f) for f in files)
+        print(f"[*] {args.clients} {args.protocol} clients from {args.base_address} in "
+              f"{args.processes} processes; file sizes p50 {percentile(sizes, 50)} "
+              f"max {sizes[-1]} bytes", file=sys.stderr)
+
+        with ProcessPoolExecutor(args.processes) as pool:
+            for step, rate in enumerate(rates, 1):
+                mode = f"open loop {rate:g} ops/s" if rate else "closed loop"
+                print(f"[*] Step {step}: {mode} for {args.duration:g} s", file=sys.stderr)
+                per_process = rate / args.processes if rate else None
+                futures = [pool.submit(run_worker, args, share, files, per_process,
+                                       args.seed * 7919 + step * 104729 + p)
+                           for p, share in enumerate(shares)]
+                results = [future.result() for future in futures]
+                records = [r for worker_records, _ in results for r in worker_records]
+                unfilled = sum(failed for _, failed in results)
+                if unfilled:
+                    print(f"[-] Prefill failed for {unfilled} clients", file=sys.stderr)
+                summary = summarize(records, args.duration)
+                if args.json:
+                    print(json.dumps({"step": step, "rate": rate, "clients": args.clients,
+                                      "summary": summary}))
+                else:
+                    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Purpose: Non-interactive client for the TCP and UDP file servers.
+
+Runs put/get commands given on the command line or in command files, with
+several transfers in flight at once, and prints one result line per transfer
+(or one JSON object per line with --json). The exit status is 1 if any
+transfer failed.
+
+Usage:
+    python tools/transfer.py <tcp|udp> <ServerPort> <ServerIP> [options] [command ...]
+
+    Commands are "put <glob>" or "get <filename>" pairs:
+        python tools/transfer.py udp 12345 127.0.0.1 put 'data/*.txt' get file1.txt
+
+    Command files hold one command per line; blank lines and lines starting
+    with '#' are skipped:
+        python tools/transfer.py tcp 12345 127.0.0.1 -f nightly.cmds -j 16
+
+Options:
+    -f, --file <path>      read commands from a file ("-" for stdin); repeatable
+    -j, --jobs <n>         transfers in flight at once (default 8)
+    --download-dir <dir>   where `get` saves files (default: current directory)
+    --bind <ip>            local address to send from
+    --timeout <seconds>    per-operation socket timeout
+    --fec [k[:r]]          UDP only: forward error correction mode with k chunks
+                           per block and r parity chunks (r adapts if omitted)
+    --tls                  TCP only: use TLS, resuming the session between transfers
+    --cafile <pem>         TCP only: trust this CA/self-signed certificate
+    --insecure             TCP only: skip certificate verification
+    --psk-file <path>      UDP only: encrypt datagrams with this pre-shared key
+    --json                 print results as JSON lines
+    --timings              print each transfer's phase/step breakdown and the
+                           totals to stderr (common/timing.py)
+    --profile-dir <dir>    write a cProfile report per transfer into <dir>
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import fec, timing
+from common.client import TCPClient, UDPClient
+from common.secure import client_tls_context, load_psk
+
+
+def parse_commands(tokens, source="command line"):
+    """
+    Turns ["put", "a*.txt", "get", "b.txt", ...] into (command, filename) pairs.
+    `put` arguments are expanded as globs; `get` arguments name server files.
+    """
+    if len(tokens) % 2:
+        raise ValueError(f"{source}: commands must be '<put|get> <filename>' pairs")
+
+    commands = []
+    for command, arg in zip(tokens[0::2], tokens[1::2]):
+        command = command.lower()
+        if command == "put":
+            matches = sorted(glob.glob(arg))
+            if not matches:
+                # Keep it so the failure is reported as a result
+                matches = [arg]
+            commands.extend(("put", path) for path in matches if not os.path.isdir(path))
+        elif command == "get":
+            commands.append(("get", arg))
+        else:
+            raise ValueError(f"{source}: unknown command '{command}'")
+    return commands
+
+
+def read_command_file(path):
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        commands = []
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            commands.extend(parse_commands(line.split(), f"{path}:{lineno}"))
+        return commands
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def format_result(result):
+    status = "OK  " if result.ok else "FAIL"
+    return (f"{status} {result.command} {result.filename} "
+            f"{result.nbytes} bytes {result.elapsed * 1000:.1f} ms  {result.message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Non-interactive file transfer client")
+    parser.add_argument("protocol", choices=["tcp", "udp"])
+    parser.add_argument("port", type=int)
+    parser.add_argument("host")
+    parser.add_argument("commands", nargs="*", help="put <glob> / get <filename> pairs")
+    parser.add_argument("-f", "--file", action="append", default=[],
+                        help="command file ('-' for stdin)")
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    parser.add_argument("--download-dir", default=".")
+    parser.add_argument("--bind", help="local address to send from")
+    parser.add_argument("--timeout", type=float)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--fec", nargs="?", const="", metavar="K[:R]",
+                        help="UDP forward error correction mode")
+    parser.add_argument("--tls", action="store_true", help="TCP over TLS")
+    parser.add_argument("--cafile", help="certificate to trust for --tls")
+    parser.add_argument("--insecure", action="store_true",
+                        help="skip certificate verification for --tls")
+    parser.add_argument("--psk-file", help="UDP pre-shared key file")
+    parser.add_argument("--timings", action="store_true",
+                        help="print per-transfer timing breakdowns to stderr")
+    parser.add_argument("--profile-dir", help="write a cProfile report per transfer here")
+    args = parser.parse_intermixed_args()
+
+    try:
+        commands = parse_commands(args.commands)
+        for path in args.file:
+            commands.extend(read_command_file(path))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not commands:
+        parser.error("no commands given")
+
+    client_class = TCPClient if args.protocol == "tcp" else UDPClient
+    options = {"download_dir": args.download_dir, "bind_address": args.bind}
+    if args.timeout is not None:
+        options["timeout"] = args.timeout
+    if args.fec is not None:
+        if args.protocol != "udp":
+            parser.error("--fec is only available with udp")
+        try:
+            options["fec_option"] = fec.parse_option(f"fec:{args.fec}" if args.fec else "fec")
+        except ValueError as e:
+            parser.error(str(e))
+    if (args.tls or args.cafile or args.insecure) and args.protocol != "tcp":
+        parser.error("--tls, --cafile and --insecure are only available with tcp")
+    if args.tls or args.cafile or args.insecure:
+        options["ssl_context"] = client_tls_context(args.cafile, verify=not args.insecure)
+    if args.psk_file:
+        if args.protocol != "udp":
+            parser.error("--psk-file is only available with udp")
+        try:
+            options["psk"] = load_psk(args.psk_file)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    options["instruments"] = timing.Instrumentation(
+        args.timings, args.profile_dir, log=lambda line: print(line, file=sys.stderr))
+
+    start = time.perf_counter()
+    with client_class(args.host, args.port, **options) as client:
+        results = client.batch(commands, workers=args.jobs)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        print(json.dumps(result._asdict()) if args.json else format_result(result))
+
+    failed = sum(not r.ok for r in results)
+    total = sum(r.nbytes for r in results)
+    summary = (f"{len(results)} transfers, {failed} failed, {total} bytes in "
+               f"{elapsed:.2f} s ({total / max(elapsed, 1e-9) / 1e6:.2f} MB/s)")
+    print(summary, file=sys.stderr)
+    if getattr(client, "ssl_context", None) is not None:
+        print(f"TLS: {client.tls_resumed} of {client.tls_handshakes} handshakes resumed a session",
+              file=sys.stderr)
+    if args.timings:
+        print(client.instruments.report(), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()